@@ -1,15 +1,9 @@
 import os
 
-import torch
 import numpy as np
 
-from douzero.evaluation.deep_agent import DeepAgent
-from douzero.env.env import get_obs
 from douzero.env.game import GameEnv
 from douzero.env.game import InfoSet
-from douzero.env.game import bombs
-from douzero.evaluation.deep_agent import DeepAgent
-from douzero.evaluation import simulation as sim
 
 dirname = os.path.dirname(os.path.abspath(__file__))
 
@@ -48,18 +42,23 @@ models = {
 }
 
 
-class DouDizhuAgent(DeepAgent):
+class DouDizhuAgent(object):
 
-    def predict(self, infoset):
-        obs = get_obs(infoset)
+    def __init__(self, position, model_path):
+        # The agents are imported here, so that importing this
+        # module does not import torch. The ONNX models do not
+        # need torch at all.
+        if model_path.endswith('.onnx'):
+            from douzero.evaluation.onnx_model import OnnxAgent
+            self.agent = OnnxAgent(position, model_path)
+            self._predict = self.agent.predict
+        else:
+            from douzero.evaluation.deep_agent import DeepAgent
+            self.agent = DeepAgent(position, model_path)
+            self._predict = self.agent._predict
 
-        z_batch = torch.from_numpy(obs['z_batch']).float()
-        x_batch = torch.from_numpy(obs['x_batch']).float()
-        if torch.cuda.is_available():
-            z_batch, x_batch = z_batch.cuda(), x_batch.cuda()
-        y_pred = self.model.forward(z_batch, x_batch, return_value=True)['values']
-        y_pred = y_pred.detach().cpu().numpy()
-        return y_pred
+    def predict(self, infoset):
+        return self._predict(infoset)
 
     def act(self, infoset):
         y_pred = self.predict(infoset)
@@ -99,33 +98,6 @@ class DouDiZhuEnv(GameEnv):
             confidence = self.players[self.acting_player_position].confident(
                 self.game_infoset, action)
 
-        if len(action) > 0:
-            self.last_pid = self.acting_player_position
-
-        if action in bombs:
-            self.bomb_num += 1
-
-        self.last_move_dict[
-            self.acting_player_position] = action.copy()
-
-        self.card_play_action_seq.append(action)
-        self.update_acting_player_hand_cards(action)
-
-        self.played_cards[self.acting_player_position] += action
-
-        if self.acting_player_position == 'landlord' and \
-                len(action) > 0 and \
-                len(self.three_landlord_cards) > 0:
-            for card in action:
-                if len(self.three_landlord_cards) > 0:
-                    if card in self.three_landlord_cards:
-                        self.three_landlord_cards.remove(card)
-                else:
-                    break
-
-        self.game_done()
-        if not self.game_over:
-            self.get_acting_player_position()
-            self.game_infoset = self.get_infoset()
+        self.apply_action(action)
 
         return action, confidence
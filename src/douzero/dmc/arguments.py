@@ -19,6 +19,30 @@ parser.add_argument('--num_actor_devices', default=1, type=int,
                     help='The number of devices used for simulation')
 parser.add_argument('--num_actors', default=5, type=int,
                     help='The number of actors for each simulation device')
+parser.add_argument('--use_move_table', action='store_true',
+                    help='Generate the legal leads from the precomputed move table')
+parser.add_argument('--legal_action_cache_size', default=0, type=int,
+                    help='The size of the legal action cache of each actor. 0 means no cache')
+parser.add_argument('--compact_obs', action='store_true',
+                    help='Send the state features once per step instead of once per legal action')
+parser.add_argument('--envs_per_actor', default=1, type=int,
+                    help='The number of games that each actor plays in lockstep, with batched forward passes')
+parser.add_argument('--num_inference_servers', default=0, type=int,
+                    help='The number of inference servers for each position and simulation device. 0 means the actors run the models themselves')
+parser.add_argument('--inference_batch_size', default=32, type=int,
+                    help='The maximum number of decisions in a batch of an inference server')
+parser.add_argument('--inference_timeout_ms', default=2.0, type=float,
+                    help='How long an inference server waits for more decisions to fill a batch')
+parser.add_argument('--inference_max_actions', default=512, type=int,
+                    help='The number of legal actions per environment that fit in the slot of an actor on the inference servers. Larger requests are run by the actor')
+parser.add_argument('--quantize_actors', action='store_true',
+                    help='Run the CPU actors with dynamic int8 quantized models')
+parser.add_argument('--quantize_interval', default=30, type=float,
+                    help='Time interval (in seconds) at which the quantized actor models are refreshed')
+parser.add_argument('--weight_sync_steps', default=4, type=int,
+                    help='The number of learning steps of a position after which its weights are published to the actors')
+parser.add_argument('--weight_sync_interval', default=5, type=float,
+                    help='Time interval (in seconds) after which the weights of a position are published to the actors, even if there are fewer steps')
 parser.add_argument('--training_device', default='0', type=str,
                     help='The index of the GPU used for training models. `cpu` means using cpu')
 parser.add_argument('--load_model', action='store_true',
@@ -41,6 +65,8 @@ parser.add_argument('--num_buffers', default=50, type=int,
                     help='Number of shared-memory buffers')
 parser.add_argument('--num_threads', default=4, type=int,
                     help='Number learner threads')
+parser.add_argument('--num_prefetch_batches', default=2, type=int,
+                    help='Number of batches per position assembled ahead of the learner threads, 0 to assemble them on the learner threads')
 parser.add_argument('--max_grad_norm', default=40., type=float,
                     help='Max norm of gradients')
 
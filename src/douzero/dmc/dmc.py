@@ -11,8 +11,12 @@ from torch import multiprocessing as mp
 from torch import nn
 
 from .file_writer import FileWriter
+from .index_queue import IndexQueue
+from .inference import start_servers
 from .models import Model
-from .utils import get_batch, log, create_env, create_buffers, create_optimizers, act
+from .timings import Timings
+from .weight_sync import WeightBroadcast
+from .utils import get_batch, log, create_env, create_buffers, create_optimizers, act, BatchPrefetcher
 
 mean_episode_return_buf = {p:deque(maxlen=100) for p in ['landlord', 'landlord_up', 'landlord_down']}
 
@@ -26,7 +30,9 @@ def learn(position,
           batch,
           optimizer,
           flags,
-          lock):
+          lock,
+          timer,
+          broadcast):
     """Performs a learning (optimization) step."""
     if flags.training_device != "cpu":
         device = torch.device('cuda:'+str(flags.training_device))
@@ -42,6 +48,7 @@ def learn(position,
     mean_episode_return_buf[position].append(torch.mean(episode_returns).to(device))
         
     with lock:
+        start = time.perf_counter()
         learner_outputs = model(obs_z, obs_x, return_value=True)
         loss = compute_loss(learner_outputs['values'], target)
         stats = {
@@ -53,10 +60,16 @@ def learn(position,
         loss.backward()
         nn.utils.clip_grad_norm_(model.parameters(), flags.max_grad_norm)
         optimizer.step()
+        timer.add('backward', position, time.perf_counter() - start)
 
-        for actor_model in actor_models.values():
-            actor_model.get_model(position).load_state_dict(model.state_dict())
-        return stats
+        start = time.perf_counter()
+        publish = broadcast.step(position, model)
+
+    # The weights are copied to the actor models outside the lock
+    if publish:
+        broadcast.publish(position, actor_models)
+        timer.add('weight_publish', position, time.perf_counter() - start)
+    return stats
 
 def train(flags):  
     """
@@ -68,6 +81,8 @@ def train(flags):
     if not flags.actor_device_cpu or flags.training_device != 'cpu':
         if not torch.cuda.is_available():
             raise AssertionError("CUDA not available. If you have GPUs, please specify the ID after `--gpu_devices`. Otherwise, please train with CPU with `python3 train.py --actor_device_cpu --training_device cpu`")
+    if flags.quantize_actors and not flags.actor_device_cpu:
+        raise AssertionError("The quantized models only run on CPU. Please use `--actor_device_cpu` with `--quantize_actors`")
     plogger = FileWriter(
         xpid=flags.xpid,
         xp_args=flags.__dict__,
@@ -103,8 +118,8 @@ def train(flags):
     full_queue = {}
         
     for device in device_iterator:
-        _free_queue = {'landlord': ctx.SimpleQueue(), 'landlord_up': ctx.SimpleQueue(), 'landlord_down': ctx.SimpleQueue()}
-        _full_queue = {'landlord': ctx.SimpleQueue(), 'landlord_up': ctx.SimpleQueue(), 'landlord_down': ctx.SimpleQueue()}
+        _free_queue = {p: IndexQueue(ctx, flags.num_buffers) for p in ['landlord', 'landlord_up', 'landlord_down']}
+        _full_queue = {p: IndexQueue(ctx, flags.num_buffers) for p in ['landlord', 'landlord_up', 'landlord_down']}
         free_queue[device] = _free_queue
         full_queue[device] = _full_queue
 
@@ -141,23 +156,49 @@ def train(flags):
         position_frames = checkpoint_states["position_frames"]
         log.info(f"Resuming preempted job, current stats:\n{stats}")
 
+    # The learner publishes its weights to the actors and the
+    # inference servers, see weight_sync.py
+    broadcast = WeightBroadcast(flags, len(device_iterator) * (flags.num_actors + 3 * flags.num_inference_servers))
+
+    # Starting inference servers, if any
+    server_processes = []
+    clients = {}
+    for device in device_iterator:
+        clients[device] = [None] * flags.num_actors
+        if flags.num_inference_servers > 0:
+            _server_processes, clients[device] = start_servers(ctx, device, models[device], flags, broadcast)
+            server_processes.extend(_server_processes)
+
+    # The stage timings, one row per actor and learner thread
+    timings = Timings(len(device_iterator) * (flags.num_actors + 3 * flags.num_threads))
+
     # Starting actor processes
     for device in device_iterator:
         num_actors = flags.num_actors
         for i in range(flags.num_actors):
             actor = ctx.Process(
                 target=act,
-                args=(i, device, free_queue[device], full_queue[device], models[device], buffers[device], flags))
+                args=(i, device, free_queue[device], full_queue[device], models[device], buffers[device], flags, clients[device][i], timings.row(), broadcast.reader()))
             actor.start()
             actor_processes.append(actor)
 
-    def batch_and_learn(i, device, position, local_lock, position_lock, lock=threading.Lock()):
+    # Guards the stats and the log file
+    stats_lock = threading.Lock()
+
+    def batch_and_learn(i, device, position, local_lock, position_lock, timer, lock=stats_lock):
         """Thread target for the learning process."""
         nonlocal frames, position_frames, stats
         while frames < flags.total_frames:
-            batch = get_batch(free_queue[device][position], full_queue[device][position], buffers[device][position], flags, local_lock)
+            start = time.perf_counter()
+            if prefetchers:
+                batch = prefetchers[device][position].get()
+            else:
+                batch = get_batch(free_queue[device][position], full_queue[device][position], buffers[device][position], flags, local_lock)
+            timer.add('batch', position, time.perf_counter() - start)
             _stats = learn(position, models, learner_model.get_model(position), batch, 
-                optimizers[position], flags, position_lock)
+                optimizers[position], flags, position_lock, timer, broadcast)
+            if prefetchers:
+                prefetchers[device][position].release(batch)
 
             with lock:
                 for k in _stats:
@@ -169,10 +210,22 @@ def train(flags):
                 position_frames[position] += T * B
 
     for device in device_iterator:
-        for m in range(flags.num_buffers):
-            free_queue[device]['landlord'].put(m)
-            free_queue[device]['landlord_up'].put(m)
-            free_queue[device]['landlord_down'].put(m)
+        free_queue[device]['landlord'].put_many(range(flags.num_buffers))
+        free_queue[device]['landlord_up'].put_many(range(flags.num_buffers))
+        free_queue[device]['landlord_down'].put_many(range(flags.num_buffers))
+
+    # The batches are assembled ahead of the learner threads
+    prefetchers = {}
+    if flags.num_prefetch_batches > 0:
+        if flags.training_device != "cpu":
+            training_device = torch.device('cuda:'+str(flags.training_device))
+        else:
+            training_device = torch.device('cpu')
+        for device in device_iterator:
+            prefetchers[device] = {
+                position: BatchPrefetcher(free_queue[device][position], full_queue[device][position],
+                                          buffers[device][position], flags, training_device)
+                for position in ['landlord', 'landlord_up', 'landlord_down']}
 
     threads = []
     locks = {}
@@ -184,7 +237,7 @@ def train(flags):
         for i in range(flags.num_threads):
             for position in ['landlord', 'landlord_up', 'landlord_down']:
                 thread = threading.Thread(
-                    target=batch_and_learn, name='batch-and-learn-%d' % i, args=(i,device,position,locks[device][position],position_locks[position]))
+                    target=batch_and_learn, name='batch-and-learn-%d' % i, args=(i,device,position,locks[device][position],position_locks[position],timings.row()))
                 thread.start()
                 threads.append(thread)
     
@@ -209,6 +262,7 @@ def train(flags):
             torch.save(learner_model.get_model(position).state_dict(), model_weights_dir)
 
     fps_log = []
+    last_timings = None
     timer = timeit.default_timer
     try:
         last_checkpoint_time = timer() - flags.save_interval * 60
@@ -241,6 +295,17 @@ def train(flags):
                      position_fps['landlord_up'],
                      position_fps['landlord_down'],
                      pprint.pformat(stats))
+            # The actors wait for free buffers, and the learner for full ones
+            log.info('Waited for buffers: actors %.1fs learner %.1fs',
+                     sum(q.wait_time() for d in free_queue.values() for q in d.values()),
+                     sum(q.wait_time() for d in full_queue.values() for q in d.values()))
+            timings_log, last_timings = timings.to_log(last_timings)
+            log.info('Stage timings (ms per call):\n%s', pprint.pformat(timings_log))
+            # How many versions the actors are behind the learner
+            policy_lag = broadcast.policy_lag()
+            log.info('Policy lag (versions):\n%s', pprint.pformat(policy_lag))
+            with stats_lock:
+                plogger.log(dict(frames=frames, **timings_log, **policy_lag))
 
     except KeyboardInterrupt:
         return 
@@ -3,69 +3,57 @@ Here, we wrap the original environment to make it easier
 to use. When a game is finished, instead of mannualy reseting
 the environment, we do it automatically.
 """
-import numpy as np
-import torch 
+import time
 
-def _format_observation(obs, device):
-    """
-    A utility function to process observations and
-    move them to CUDA.
-    """
-    position = obs['position']
-    if not device == "cpu":
-        device = 'cuda:' + str(device)
-    device = torch.device(device)
-    x_batch = torch.from_numpy(obs['x_batch']).to(device)
-    z_batch = torch.from_numpy(obs['z_batch']).to(device)
-    x_no_action = torch.from_numpy(obs['x_no_action'])
-    z = torch.from_numpy(obs['z'])
-    obs = {'x_batch': x_batch,
-           'z_batch': z_batch,
-           'legal_actions': obs['legal_actions'],
-           }
-    return position, obs, x_no_action, z
+from douzero.env.env import get_obs_batch
 
-class Environment:
-    def __init__(self, env, device):
-        """ Initialzie this environment wrapper
+class VecEnvironment:
+    def __init__(self, envs, compact):
         """
-        self.env = env
-        self.device = device
-        self.episode_return = None
+        Step `envs`, which are created with `build_obs=False`, in
+        lockstep, and build the observations of all of them at once
+        with `get_obs_batch`. The observations are in numpy, grouped
+        by position, and compact if `compact` is set.
+        """
+        self.envs = envs
+        self.compact = compact
+        self.episode_returns = [0.0 for _ in envs]
+        # The total seconds spent building the observations
+        self.feature_time = 0.0
 
     def initial(self):
-        initial_position, initial_obs, x_no_action, z = _format_observation(self.env.reset(), self.device)
-        initial_reward = torch.zeros(1, 1)
-        self.episode_return = torch.zeros(1, 1)
-        initial_done = torch.ones(1, 1, dtype=torch.bool)
-
-        return initial_position, initial_obs, dict(
-            done=initial_done,
-            episode_return=self.episode_return,
-            obs_x_no_action=x_no_action,
-            obs_z=z,
-            )
-        
-    def step(self, action):
-        obs, reward, done, _ = self.env.step(action)
-
-        self.episode_return += reward
-        episode_return = self.episode_return 
-
-        if done:
-            obs = self.env.reset()
-            self.episode_return = torch.zeros(1, 1)
+        for env in self.envs:
+            env.reset()
+        self.episode_returns = [0.0 for _ in self.envs]
+        return self._observe([dict(done=True, episode_return=0.0) for _ in self.envs])
 
-        position, obs, x_no_action, z = _format_observation(obs, self.device)
-        reward = torch.tensor(reward).view(1, 1)
-        done = torch.tensor(done).view(1, 1)
-        
-        return position, obs, dict(
-            done=done,
-            episode_return=episode_return,
-            obs_x_no_action=x_no_action,
-            obs_z=z,
-            )
-
-    def close(self):
-        self.env.close()
+    def step(self, actions):
+        """
+        Play an action in every environment. It returns the position
+        of every environment, the observations of `get_obs_batch`,
+        and the outputs of every environment, i.e., the done flag, the
+        episode return, and the features and the legal actions of its
+        observation. The finished games are reset.
+        """
+        env_outputs = []
+        for k, (env, action) in enumerate(zip(self.envs, actions)):
+            _, reward, done, _ = env.step(action)
+            self.episode_returns[k] += reward
+            env_outputs.append(dict(done=done, episode_return=self.episode_returns[k]))
+            if done:
+                env.reset()
+                self.episode_returns[k] = 0.0
+        return self._observe(env_outputs)
+
+    def _observe(self, env_outputs):
+        start = time.perf_counter()
+        obs_batch = get_obs_batch([env.infoset for env in self.envs], self.compact)
+        self.feature_time += time.perf_counter() - start
+        positions = [None] * len(self.envs)
+        for position, obs in obs_batch.items():
+            for j, k in enumerate(obs['indices']):
+                positions[k] = position
+                env_outputs[k].update(obs_x_no_action=obs['x_no_action'][j],
+                                      obs_z=obs['z'][j],
+                                      legal_actions=obs['legal_actions'][j])
+        return positions, obs_batch, env_outputs
@@ -0,0 +1,89 @@
+"""
+The queues of buffer indices between the actors and the learner.
+A `SimpleQueue` pickles every index and sends it through a pipe.
+Here the indices are kept in a ring in shared memory, so a `put`
+or a `get` is a few array writes under a lock, and a batch of
+indices is moved at once with `put_many`/`get_many`.
+"""
+import time
+
+import numpy as np
+import torch
+
+class IndexQueue(object):
+    """
+    A FIFO queue of buffer indices in shared memory. Every index
+    is in at most one queue at a time, so a queue never holds
+    more than `capacity` indices and `put` never blocks. `get`
+    blocks until there are indices, and the time spent waiting
+    is added to `wait_time`. `None` can be put to stop an actor,
+    see `act` in utils.py.
+    """
+    def __init__(self, ctx, capacity):
+        self.capacity = capacity
+        self.ring = torch.zeros(capacity, dtype=torch.int64).share_memory_()
+        # The number of indices ever put and ever taken, the number
+        # of getters waiting, and the seconds spent waiting in `get`
+        self.counters = torch.zeros(3, dtype=torch.int64).share_memory_()
+        self.waits = torch.zeros(1, dtype=torch.float64).share_memory_()
+        self.cond = ctx.Condition()
+        self._arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def _get_arrays(self):
+        # The numpy views are made in each process, since
+        # only the tensors are shared when pickled
+        if self._arrays is None:
+            self._arrays = (self.ring.numpy(), self.counters.numpy(), self.waits.numpy())
+        return self._arrays
+
+    def put(self, index):
+        self.put_many([index])
+
+    def put_many(self, indices):
+        ring, counters, _ = self._get_arrays()
+        indices = [-1 if m is None else m for m in indices]
+        with self.cond:
+            tail = counters[0]
+            if len(indices) == 1:
+                ring[tail % self.capacity] = indices[0]
+            else:
+                ring[np.arange(tail, tail + len(indices)) % self.capacity] = indices
+            counters[0] += len(indices)
+            if counters[2] > 0:
+                self.cond.notify_all()
+
+    def get(self):
+        return self.get_many(1)[0]
+
+    def get_many(self, n):
+        """
+        Take `n` indices at once, so that two getters of a batch
+        never each hold a part of the indices
+        """
+        ring, counters, waits = self._get_arrays()
+        with self.cond:
+            if counters[0] - counters[1] < n:
+                start = time.perf_counter()
+                counters[2] += 1
+                while counters[0] - counters[1] < n:
+                    self.cond.wait()
+                counters[2] -= 1
+                waits[0] += time.perf_counter() - start
+            head = counters[1]
+            if n == 1:
+                indices = [int(ring[head % self.capacity])]
+            else:
+                indices = ring[np.arange(head, head + n) % self.capacity].tolist()
+            counters[1] += n
+        return [None if m < 0 else m for m in indices]
+
+    def wait_time(self):
+        """
+        The total seconds spent waiting in `get`
+        """
+        return float(self.waits[0])
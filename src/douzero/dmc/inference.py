@@ -0,0 +1,159 @@
+"""
+An optional inference server for the actors. Instead of running
+the model for one decision at a time in every actor, the actors
+write the observations of their pending decisions of a position
+into their shared-memory slot and send one request to a server of
+the position. The server collects the requests until the batch is
+full or the latency budget is over, runs one forward pass for all
+of them, and sends back the indices of the chosen actions.
+"""
+import copy
+import logging
+import queue
+import time
+import traceback
+
+import numpy as np
+import torch
+
+from .models import forward_decisions, quantize_model, select_actions
+
+log = logging.getLogger('doudzero')
+
+positions = ['landlord', 'landlord_up', 'landlord_down']
+
+def create_slots(flags, num_actors):
+    """
+    One slot per actor in shared memory, which holds the decisions
+    of the `flags.envs_per_actor` environments of the actor. An
+    actor makes one request at a time, so the slot is only written
+    by the actor while it has no request in flight. The observations
+    are in the compact form of `get_obs_batch` in env.py, with the
+    action rows of the decisions concatenated.
+    """
+    K = flags.envs_per_actor
+    max_actions = K * flags.inference_max_actions
+    return dict(
+        x_no_action=torch.zeros(num_actors, K, 430, dtype=torch.int8).share_memory_(),
+        z=torch.zeros(num_actors, K, 5, 162, dtype=torch.int8).share_memory_(),
+        x_action=torch.zeros(num_actors, max_actions, 54, dtype=torch.int8).share_memory_(),
+        num_actions=torch.zeros(num_actors, K, dtype=torch.int64).share_memory_(),
+    )
+
+class InferenceClient(object):
+    """
+    The actor side of the server. `act` returns the indices of the
+    chosen actions, or None if the observations do not fit in the
+    slot, in which case the actor runs the model itself.
+    """
+    def __init__(self, i, slots, request_queues, response_queue):
+        self.i = i
+        self.slots = slots
+        self.request_queues = request_queues
+        self.response_queue = response_queue
+
+    def act(self, position, obs):
+        """
+        The decisions of a position in the compact form of
+        `get_obs_batch`, all in one request
+        """
+        num_rows = obs['x_action'].shape[0]
+        if num_rows > self.slots['x_action'].shape[1]:
+            return None
+        n, x_dim = obs['x_no_action'].shape
+        self.slots['x_no_action'][self.i, :n, :x_dim] = torch.from_numpy(obs['x_no_action'])
+        self.slots['z'][self.i, :n] = torch.from_numpy(obs['z'])
+        self.slots['x_action'][self.i, :num_rows] = torch.from_numpy(obs['x_action'])
+        self.slots['num_actions'][self.i, :n] = torch.from_numpy(np.diff(obs['offsets']))
+        self.request_queues[position].put((self.i, n))
+        return self.response_queue.get()
+
+def _get_requests(request_queue, flags):
+    """
+    Block until there is a request, and then wait for more requests
+    until the batch is full or the timeout is over. A request is the
+    index of an actor and its number of decisions.
+    """
+    requests = [request_queue.get()]
+    num_decisions = requests[0][1]
+    deadline = time.monotonic() + flags.inference_timeout_ms / 1000
+    while num_decisions < flags.inference_batch_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            requests.append(request_queue.get(timeout=timeout))
+        except queue.Empty:
+            break
+        num_decisions += requests[-1][1]
+    return requests
+
+def serve(position, device, model, slots, request_queue, response_queues, flags, weights):
+    """
+    The target of a server process. It runs forever until we stop it.
+    Like the actors, it runs a local copy of the model, and copies
+    the new weights between batches, see weight_sync.py.
+    """
+    try:
+        log.info('Device %s %s inference server started.', str(device), position)
+        if not device == "cpu":
+            device = 'cuda:' + str(device)
+        device = torch.device(device)
+        shared_model = model.get_model(position)
+        local_model = copy.deepcopy(shared_model)
+        model = local_model
+        if flags.quantize_actors:
+            model = quantize_model(local_model)
+            last_quantize_time = time.time()
+        x_dim = 319 if position == 'landlord' else 430
+
+        while True:
+            requests = _get_requests(request_queue, flags)
+            if not flags.quantize_actors or time.time() - last_quantize_time > flags.quantize_interval:
+                if weights.refresh(position, shared_model, local_model) and flags.quantize_actors:
+                    model = quantize_model(local_model)
+                    last_quantize_time = time.time()
+            num_actions = [slots['num_actions'][i, :n].tolist() for i, n in requests]
+            x_no_action = torch.cat([slots['x_no_action'][i, :n, :x_dim] for i, n in requests]).to(device)
+            z = torch.cat([slots['z'][i, :n] for i, n in requests]).to(device)
+            x_action = torch.cat([slots['x_action'][i, :sum(_num_actions)] for (i, _), _num_actions in
+                                  zip(requests, num_actions)]).to(device)
+            with torch.no_grad():
+                values = forward_decisions(model, z, x_no_action, x_action,
+                                           sum(num_actions, []))
+            actions = select_actions(values, sum(num_actions, []), flags)
+            for i, n in requests:
+                response_queues[i].put(actions[:n])
+                actions = actions[n:]
+
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        log.error('Exception in %s inference server', position)
+        traceback.print_exc()
+        print()
+        raise e
+
+def start_servers(ctx, device, model, flags, broadcast):
+    """
+    Start `flags.num_inference_servers` servers per position for
+    the actors of a device, and return the processes and a client
+    for each actor. Each server gets a reader of `broadcast`.
+    """
+    slots = create_slots(flags, flags.num_actors)
+    request_queues = {p: ctx.Queue() for p in positions}
+    response_queues = [ctx.SimpleQueue() for _ in range(flags.num_actors)]
+
+    processes = []
+    for position in positions:
+        for _ in range(flags.num_inference_servers):
+            server = ctx.Process(
+                target=serve,
+                args=(position, device, model, slots, request_queues[position],
+                      response_queues, flags, broadcast.reader([position])))
+            server.start()
+            processes.append(server)
+
+    clients = [InferenceClient(i, slots, request_queues, response_queues[i])
+               for i in range(flags.num_actors)]
+    return processes, clients
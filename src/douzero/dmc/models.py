@@ -2,12 +2,89 @@
 This file includes the torch models. We wrap the three
 models into one class for convenience.
 """
+import copy
 
 import numpy as np
 
 import torch
 from torch import nn
 
+def _expand_obs(x, x_action):
+    """
+    Expand a compact observation (see `get_compact_obs` in env.py),
+    i.e., the state features `x` of one step and the action features
+    `x_action`, into the rows of x_batch. The state features are
+    broadcast with `expand` instead of copied.
+    """
+    num_actions = x_action.shape[0]
+    return torch.cat([x.float().expand(num_actions, x.shape[-1]),
+                      x_action.float()], dim=-1)
+
+def _encode_history(lstm, z, num_rows):
+    """
+    Encode the historical moves. The legal actions of a step share
+    the same history, so `z` can also be given once, with shape
+    (5, 162). It is then encoded once and the output is broadcast
+    to the `num_rows` rows instead of running the LSTM on every row.
+    """
+    if z.dim() == 2:
+        lstm_out, (h_n, _) = lstm(z.float().unsqueeze(0))
+        return lstm_out[:, -1, :].expand(num_rows, -1)
+    lstm_out, (h_n, _) = lstm(z)
+    return lstm_out[:, -1, :]
+
+def encode_histories(model, z):
+    """
+    Encode the histories of a batch of decisions, one per decision,
+    with shape (B, 5, 162). The outputs can be indexed to the action
+    rows and given to `forward` as `history`.
+    """
+    return _encode_history(model.lstm, z.float(), z.shape[0])
+
+def forward_decisions(model, z, x_no_action, x_action, num_actions):
+    """
+    The values of the legal actions of several decisions of a position
+    in one forward pass. The decisions are given in the compact form
+    (see `get_compact_obs` in env.py) with their `z` and `x_no_action`
+    stacked, and their `x_action` concatenated, where `num_actions` is
+    the number of legal actions of each decision. It returns the values
+    of all the action rows, concatenated in the same way.
+    """
+    rows = torch.repeat_interleave(
+        torch.arange(len(num_actions), device=z.device),
+        torch.tensor(num_actions, device=z.device))
+    history = encode_histories(model, z)[rows]
+    x = torch.cat([x_no_action[rows].float(), x_action.float()], dim=-1)
+    return model.forward(None, x, return_value=True,
+                         history=history)['values'].squeeze(-1)
+
+def select_actions(values, num_actions, flags=None):
+    """
+    The index of the chosen action of each decision, given the values
+    of `forward_decisions`. It explores in the same way as `forward`.
+    """
+    values = values.cpu().numpy()
+    action_indices = []
+    offset = 0
+    for n in num_actions:
+        if flags is not None and flags.exp_epsilon > 0 and np.random.rand() < flags.exp_epsilon:
+            action_indices.append(int(np.random.randint(n)))
+        else:
+            action_indices.append(int(np.argmax(values[offset: offset + n])))
+        offset += n
+    return action_indices
+
+def step_history(model, z, state=None):
+    """
+    Feed the timesteps `z`, with shape (T, 162), to the LSTM of
+    `model`, starting from `state`, i.e., the (h, c) returned by the
+    previous call, or zeros if it is None. It returns the output of
+    the last timestep, which can be given to `forward` as `history`,
+    and the new state.
+    """
+    lstm_out, state = model.lstm(z.float().unsqueeze(0), state)
+    return lstm_out[:, -1, :], state
+
 class LandlordLstmModel(nn.Module):
     def __init__(self):
         super().__init__()
@@ -19,9 +96,14 @@ class LandlordLstmModel(nn.Module):
         self.dense5 = nn.Linear(512, 512)
         self.dense6 = nn.Linear(512, 1)
 
-    def forward(self, z, x, return_value=False, flags=None):
-        lstm_out, (h_n, _) = self.lstm(z)
-        lstm_out = lstm_out[:,-1,:]
+    def forward(self, z, x, return_value=False, flags=None, x_action=None,
+                history=None):
+        if x_action is not None:
+            x = _expand_obs(x, x_action)
+        if history is not None:
+            lstm_out = history.expand(x.shape[0], -1)
+        else:
+            lstm_out = _encode_history(self.lstm, z, x.shape[0])
         x = torch.cat([lstm_out,x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
@@ -54,9 +136,14 @@ class FarmerLstmModel(nn.Module):
         self.dense5 = nn.Linear(512, 512)
         self.dense6 = nn.Linear(512, 1)
 
-    def forward(self, z, x, return_value=False, flags=None):
-        lstm_out, (h_n, _) = self.lstm(z)
-        lstm_out = lstm_out[:,-1,:]
+    def forward(self, z, x, return_value=False, flags=None, x_action=None,
+                history=None):
+        if x_action is not None:
+            x = _expand_obs(x, x_action)
+        if history is not None:
+            lstm_out = history.expand(x.shape[0], -1)
+        else:
+            lstm_out = _encode_history(self.lstm, z, x.shape[0])
         x = torch.cat([lstm_out,x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
@@ -78,6 +165,16 @@ class FarmerLstmModel(nn.Module):
                 action = torch.argmax(x,dim=0)[0]
             return dict(action=action)
 
+def quantize_model(model):
+    """
+    A copy of a model with dynamic int8 Linear and LSTM layers.
+    The weights are quantized once, and the activations on the
+    fly, so it only runs on CPU and can not be trained.
+    """
+    model = copy.deepcopy(model).cpu()
+    return torch.ao.quantization.quantize_dynamic(
+        model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+
 # Model dict is only used in evaluation but not training
 model_dict = {}
 model_dict['landlord'] = LandlordLstmModel
@@ -97,9 +194,21 @@ class Model:
         self.models['landlord_up'] = FarmerLstmModel().to(torch.device(device))
         self.models['landlord_down'] = FarmerLstmModel().to(torch.device(device))
 
-    def forward(self, position, z, x, training=False, flags=None):
+    def forward(self, position, z, x, training=False, flags=None,
+                x_action=None):
         model = self.models[position]
-        return model.forward(z, x, training, flags)
+        return model.forward(z, x, training, flags, x_action)
+
+    def quantize(self):
+        """
+        A copy of the wrapper with the quantized models, see
+        `quantize_model`. It does not follow later updates of
+        the weights, so it has to be quantized again.
+        """
+        quantized = copy.copy(self)
+        quantized.models = {position: quantize_model(model)
+                            for position, model in self.models.items()}
+        return quantized
 
     def share_memory(self):
         self.models['landlord'].share_memory()
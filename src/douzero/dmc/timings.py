@@ -0,0 +1,107 @@
+"""
+Per-stage timing counters of the actors and the learner, to tell
+whether a run is bound by the actors, the learner or the queues.
+The counters are in shared memory, and every writer, i.e., an
+actor process or a learner thread, has its own row, so they are
+updated without locks. `train` sums the rows and writes the mean
+time per call of every stage and position through `FileWriter`,
+along with the hit rate of the legal action caches of the actors.
+"""
+import torch
+
+positions = ['landlord', 'landlord_up', 'landlord_down']
+
+# The stages of the actors and of the learner
+stages = [
+    'env_step',       # stepping the game, without the features
+    'features',       # building the observation
+    'forward',        # choosing the action with the model
+    'buffer_wait',    # waiting for a free buffer
+    'batch',          # waiting for or assembling a batch
+    'backward',       # the forward and backward passes and the optimizer step
+    'weight_publish', # publishing the weights of the learner
+    'weight_pull',    # copying the published weights to an actor
+]
+
+class Timings(object):
+    """
+    The counters of `num_rows` writers, see `row`
+    """
+    def __init__(self, num_rows):
+        self.times = torch.zeros(num_rows, len(stages), len(positions),
+                                 dtype=torch.float64).share_memory_()
+        self.counts = torch.zeros(num_rows, len(stages), len(positions),
+                                  dtype=torch.int64).share_memory_()
+        # The hits and misses of the legal action caches
+        self.cache = torch.zeros(num_rows, 2, dtype=torch.int64).share_memory_()
+        self.num_rows = num_rows
+        self.next_row = 0
+
+    def row(self):
+        """
+        The counters of a new writer
+        """
+        assert self.next_row < self.num_rows, 'Not enough rows for the writers'
+        row = StageTimer(self.times[self.next_row], self.counts[self.next_row],
+                         self.cache[self.next_row])
+        self.next_row += 1
+        return row
+
+    def totals(self):
+        """
+        The total seconds and calls of every stage and position,
+        and the total hits and misses of the caches
+        """
+        return self.times.sum(0).numpy(), self.counts.sum(0).numpy(), self.cache.sum(0).numpy()
+
+    def to_log(self, last_totals=None):
+        """
+        The mean milliseconds per call of every stage and position,
+        and the cache hit rate, since `last_totals`, and the new totals
+        """
+        times, counts, cache = self.totals()
+        if last_totals is not None:
+            times, counts, cache = times - last_totals[0], counts - last_totals[1], cache - last_totals[2]
+        to_log = {}
+        for s, stage in enumerate(stages):
+            for p, position in enumerate(positions):
+                if counts[s, p] > 0:
+                    to_log['time_%s_%s' % (stage, position)] = float(1000 * times[s, p] / counts[s, p])
+        hits, misses = int(cache[0]), int(cache[1])
+        if hits + misses > 0:
+            to_log['legal_action_cache_hits'] = hits
+            to_log['legal_action_cache_misses'] = misses
+            to_log['legal_action_cache_hit_rate'] = hits / (hits + misses)
+        return to_log, self.totals()
+
+class StageTimer(object):
+    """
+    The counters of one writer
+    """
+    def __init__(self, times, counts, cache):
+        self.times = times
+        self.counts = counts
+        self.cache = cache
+        self._arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def add(self, stage, position, seconds):
+        if self._arrays is None:
+            # The numpy views are made in each process, since
+            # only the tensors are shared when pickled
+            self._arrays = (self.times.numpy(), self.counts.numpy())
+        times, counts = self._arrays
+        s, p = stages.index(stage), positions.index(position)
+        times[s, p] += seconds
+        counts[s, p] += 1
+
+    def set_cache_stats(self, hits, misses):
+        """
+        The total hits and misses of the caches of the writer
+        """
+        self.cache[0] = hits
+        self.cache[1] = misses
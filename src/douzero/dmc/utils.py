@@ -1,25 +1,23 @@
 import os 
+import copy
 import typing
 import logging
+import queue
+import threading
 import traceback
 import numpy as np
-from collections import Counter
 import time
 
 import torch 
 from torch import multiprocessing as mp
 
-from .env_utils import Environment
+from .env_utils import VecEnvironment
+from .models import forward_decisions, select_actions
+from .timings import Timings
+from .weight_sync import WeightBroadcast
 from douzero.env import Env
-
-Card2Column = {3: 0, 4: 1, 5: 2, 6: 3, 7: 4, 8: 5, 9: 6, 10: 7,
-               11: 8, 12: 9, 13: 10, 14: 11, 17: 12}
-
-NumOnes2Array = {0: np.array([0, 0, 0, 0]),
-                 1: np.array([1, 0, 0, 0]),
-                 2: np.array([1, 1, 0, 0]),
-                 3: np.array([1, 1, 1, 0]),
-                 4: np.array([1, 1, 1, 1])}
+from douzero.env import encoding
+from douzero.env.action_cache import LegalActionCache
 
 shandle = logging.StreamHandler()
 shandle.setFormatter(
@@ -35,8 +33,15 @@ log.setLevel(logging.INFO)
 # and learner processes. They are shared tensors in GPU
 Buffers = typing.Dict[str, typing.List[torch.Tensor]]
 
-def create_env(flags):
-    return Env(flags.objective)
+def create_env(flags, build_obs=True):
+    legal_action_cache = None
+    if flags.legal_action_cache_size > 0:
+        legal_action_cache = LegalActionCache(flags.legal_action_cache_size)
+    return Env(flags.objective,
+               use_move_table=flags.use_move_table,
+               legal_action_cache=legal_action_cache,
+               compact_obs=flags.compact_obs or flags.num_inference_servers > 0 or flags.envs_per_actor > 1,
+               build_obs=build_obs)
 
 def get_batch(free_queue,
               full_queue,
@@ -49,15 +54,103 @@ def get_batch(free_queue,
     free the indices by sending it to full_queue.
     """
     with lock:
-        indices = [full_queue.get() for _ in range(flags.batch_size)]
+        indices = full_queue.get_many(flags.batch_size)
     batch = {
         key: torch.stack([buffers[key][m] for m in indices], dim=1)
         for key in buffers
     }
-    for m in indices:
-        free_queue.put(m)
+    free_queue.put_many(indices)
     return batch
 
+class BatchPrefetcher(object):
+    """
+    Assemble the batches of a position on a background thread,
+    ahead of the learner threads. The buffer slots are stacked into
+    staging tensors, pinned if the learner is on a GPU, and copied
+    to the training device with non_blocking copies on a side
+    stream. If the buffers are already on the training device, e.g.,
+    on CPU or with the default GPU flags, the staging tensors are the
+    batches themselves, so it is double buffering. `get` returns the
+    next batch, the same as `get_batch`, and the learner gives it back
+    with `release` once it is done with it, so that a staging batch
+    is never overwritten while in use.
+    """
+    def __init__(self, free_queue, full_queue, buffers, flags, device):
+        self.free_queue = free_queue
+        self.full_queue = full_queue
+        self.buffers = buffers
+        self.batch_size = flags.batch_size
+        self.device = device
+
+        buffer_device = buffers['done'][0].device
+        # Whether the batches are copies of the staging batches
+        self.copy = buffer_device != device
+        self.stream = None
+        if self.copy and device.type == 'cuda':
+            self.stream = torch.cuda.Stream(device)
+        pin_memory = self.stream is not None and buffer_device.type == 'cpu'
+        # The free staging batches. A staging batch may be used by every
+        # learner thread, waiting in the queue, or being filled.
+        num_staging = flags.num_threads + flags.num_prefetch_batches + 1
+        self.free_staging = queue.Queue()
+        for _ in range(num_staging):
+            staging = {}
+            for key, _buffers in buffers.items():
+                shape = (_buffers[0].shape[0], self.batch_size) + _buffers[0].shape[1:]
+                staging[key] = torch.empty(shape, dtype=_buffers[0].dtype, device=buffer_device,
+                                           pin_memory=pin_memory)
+            self.free_staging.put(staging)
+
+        self.batches = queue.Queue(maxsize=flags.num_prefetch_batches)
+        self.thread = threading.Thread(target=self._prefetch, daemon=True)
+        self.thread.start()
+
+    def get(self):
+        return self.batches.get()
+
+    def release(self, batch):
+        """
+        Give back a batch of `get` after the learning step
+        """
+        if not self.copy:
+            # The batch is a staging batch
+            self.free_staging.put(batch)
+
+    def _prefetch(self):
+        try:
+            while True:
+                staging = self.free_staging.get()
+                indices = self.full_queue.get_many(self.batch_size)
+                for key in staging:
+                    torch.stack([self.buffers[key][m] for m in indices], dim=1, out=staging[key])
+                self.free_queue.put_many(indices)
+
+                if not self.copy:
+                    # Given back by `release`
+                    batch = staging
+                elif self.stream is None:
+                    batch = {key: tensor.to(self.device)
+                             for key, tensor in staging.items()}
+                    self.free_staging.put(staging)
+                else:
+                    with torch.cuda.stream(self.stream):
+                        batch = {key: tensor.to(self.device, non_blocking=True)
+                                 for key, tensor in staging.items()}
+                    # Wait here rather than in the learner, and tell the
+                    # allocator that the learner's stream uses the batch
+                    self.stream.synchronize()
+                    for tensor in batch.values():
+                        tensor.record_stream(torch.cuda.current_stream(self.device))
+                    # The batch is a copy, so the staging batch is free
+                    self.free_staging.put(staging)
+                self.batches.put(batch)
+
+        except Exception as e:
+            log.error('Exception in batch prefetcher')
+            traceback.print_exc()
+            print()
+            raise e
+
 def create_optimizers(flags, learner_model):
     """
     Create three optimizers for the three positions
@@ -106,74 +199,134 @@ def create_buffers(flags, device_iterator):
             buffers[device][position] = _buffers
     return buffers
 
-def act(i, device, free_queue, full_queue, model, buffers, flags):
+def _choose_actions(obs_batch, num_envs, model, model_device, client, flags):
+    """
+    Choose the actions of the pending decisions of all the environments
+    of an actor, given their observations from `get_obs_batch`. The
+    decisions of the same position are evaluated in one batched forward
+    pass, or sent to an inference server in one request.
+    """
+    action_indices = [None] * num_envs
+    for position, obs in obs_batch.items():
+        indices = None
+        if client is not None:
+            indices = client.act(position, obs)
+        if indices is None:
+            with torch.no_grad():
+                if 'x_action' in obs:
+                    num_actions = np.diff(obs['offsets']).tolist()
+                    z = torch.from_numpy(obs['z']).to(model_device)
+                    x_no_action = torch.from_numpy(obs['x_no_action']).to(model_device)
+                    x_action = torch.from_numpy(obs['x_action']).to(model_device)
+                    values = forward_decisions(model.get_model(position), z, x_no_action, x_action, num_actions)
+                    indices = select_actions(values, num_actions, flags)
+                else:
+                    # The observations are only expanded with one
+                    # environment, see `create_env`
+                    z_batch = torch.from_numpy(obs['z_batch']).to(model_device)
+                    x_batch = torch.from_numpy(obs['x_batch']).to(model_device)
+                    agent_output = model.forward(position, z_batch, x_batch, flags=flags)
+                    indices = [int(agent_output['action'].cpu().detach().numpy())]
+        for k, action_idx in zip(obs['indices'], indices):
+            action_indices[k] = action_idx
+    return action_indices
+
+def act(i, device, free_queue, full_queue, model, buffers, flags, client=None, timer=None, weights=None):
     """
     This function will run forever until we stop it. It will generate
     data from the environment and send the data to buffer. It uses
     a free queue and full queue to syncup with the main process.
+    If `client` is given, the actions are chosen by the inference
+    servers (see inference.py). The actor steps `flags.envs_per_actor`
+    environments in lockstep, each with its own trajectories. The
+    time of every stage is added to `timer`, see timings.py. The
+    actor acts with a local copy of `model`, and `weights` tells
+    it when to copy the weights again, see weight_sync.py.
     """
     positions = ['landlord', 'landlord_up', 'landlord_down']
     try:
         T = flags.unroll_length
         log.info('Device %s Actor %i started.', str(device), i)
+        if timer is None:
+            timer = Timings(1).row()
+        if weights is None:
+            weights = WeightBroadcast(flags, 1).reader()
+
+        envs = [create_env(flags, build_obs=False) for _ in range(flags.envs_per_actor)]
+        vec_env = VecEnvironment(envs, envs[0].compact_obs)
+        model_device = torch.device('cpu' if device == 'cpu' else 'cuda:' + str(device))
+        caches = [env.legal_action_cache for env in envs if env.legal_action_cache is not None]
 
-        env = create_env(flags)
-        env = Environment(env, device)
+        # The weights are copied from the shared models between
+        # games. The quantized models are at most refreshed every
+        # `flags.quantize_interval` seconds.
+        local_model = copy.deepcopy(model)
+        actor_model = local_model
+        if flags.quantize_actors:
+            actor_model = local_model.quantize()
+            last_quantize_time = time.time()
 
-        done_buf = {p: [] for p in positions}
-        episode_return_buf = {p: [] for p in positions}
-        target_buf = {p: [] for p in positions}
-        obs_x_no_action_buf = {p: [] for p in positions}
-        obs_action_buf = {p: [] for p in positions}
-        obs_z_buf = {p: [] for p in positions}
-        size = {p: 0 for p in positions}
+        rollouts = [{p: Rollout(p, 2 * T) for p in positions} for _ in envs]
 
-        position, obs, env_output = env.initial()
+        states, obs_batch, env_outputs = vec_env.initial()
 
         while True:
-            while True:
-                obs_x_no_action_buf[position].append(env_output['obs_x_no_action'])
-                obs_z_buf[position].append(env_output['obs_z'])
-                with torch.no_grad():
-                    agent_output = model.forward(position, obs['z_batch'], obs['x_batch'], flags=flags)
-                _action_idx = int(agent_output['action'].cpu().detach().numpy())
-                action = obs['legal_actions'][_action_idx]
-                obs_action_buf[position].append(_cards2tensor(action))
-                position, obs, env_output = env.step(action)
-                size[position] += 1
-                if env_output['done']:
+            for k, position in enumerate(states):
+                rollouts[k][position].add_obs(env_outputs[k]['obs_x_no_action'], env_outputs[k]['obs_z'])
+            start = time.perf_counter()
+            action_indices = _choose_actions(obs_batch, len(envs), actor_model, model_device, client, flags)
+            # The decisions are made together, so they share the time
+            forward_time = (time.perf_counter() - start) / len(envs)
+            for position in states:
+                timer.add('forward', position, forward_time)
+
+            actions = []
+            for k, position in enumerate(states):
+                action = env_outputs[k]['legal_actions'][action_indices[k]]
+                rollouts[k][position].add_action(action)
+                actions.append(action)
+
+            # The environments are stepped together, so they share the time
+            start, feature_time = time.perf_counter(), vec_env.feature_time
+            acting_positions = states
+            states, obs_batch, env_outputs = vec_env.step(actions)
+            feature_time = vec_env.feature_time - feature_time
+            step_time = time.perf_counter() - start - feature_time
+            for position in acting_positions:
+                timer.add('env_step', position, step_time / len(envs))
+                timer.add('features', position, feature_time / len(envs))
+
+            for k, env_output in enumerate(env_outputs):
+                if not env_output['done']:
+                    continue
+
+                if not flags.quantize_actors or time.time() - last_quantize_time > flags.quantize_interval:
+                    updated = False
                     for p in positions:
-                        diff = size[p] - len(target_buf[p])
-                        if diff > 0:
-                            done_buf[p].extend([False for _ in range(diff-1)])
-                            done_buf[p].append(True)
-
-                            episode_return = env_output['episode_return'] if p == 'landlord' else -env_output['episode_return']
-                            episode_return_buf[p].extend([0.0 for _ in range(diff-1)])
-                            episode_return_buf[p].append(episode_return)
-                            target_buf[p].extend([episode_return for _ in range(diff)])
-                    break
-
-            for p in positions:
-                if size[p] > T: 
-                    index = free_queue[p].get()
-                    if index is None:
-                        break
-                    for t in range(T):
-                        buffers[p]['done'][index][t, ...] = done_buf[p][t]
-                        buffers[p]['episode_return'][index][t, ...] = episode_return_buf[p][t]
-                        buffers[p]['target'][index][t, ...] = target_buf[p][t]
-                        buffers[p]['obs_x_no_action'][index][t, ...] = obs_x_no_action_buf[p][t]
-                        buffers[p]['obs_action'][index][t, ...] = obs_action_buf[p][t]
-                        buffers[p]['obs_z'][index][t, ...] = obs_z_buf[p][t]
-                    full_queue[p].put(index)
-                    done_buf[p] = done_buf[p][T:]
-                    episode_return_buf[p] = episode_return_buf[p][T:]
-                    target_buf[p] = target_buf[p][T:]
-                    obs_x_no_action_buf[p] = obs_x_no_action_buf[p][T:]
-                    obs_action_buf[p] = obs_action_buf[p][T:]
-                    obs_z_buf[p] = obs_z_buf[p][T:]
-                    size[p] -= T
+                        start = time.perf_counter()
+                        if weights.refresh(p, model.get_model(p), local_model.get_model(p)):
+                            timer.add('weight_pull', p, time.perf_counter() - start)
+                            updated = True
+                    if updated and flags.quantize_actors:
+                        actor_model = local_model.quantize()
+                        last_quantize_time = time.time()
+
+                if caches:
+                    timer.set_cache_stats(sum(c.hits for c in caches), sum(c.misses for c in caches))
+
+                for p in positions:
+                    episode_return = env_output['episode_return'] if p == 'landlord' else -env_output['episode_return']
+                    rollouts[k][p].end_game(float(episode_return))
+
+                for p in positions:
+                    if rollouts[k][p].size > T:
+                        start = time.perf_counter()
+                        index = free_queue[p].get()
+                        timer.add('buffer_wait', p, time.perf_counter() - start)
+                        if index is None:
+                            break
+                        rollouts[k][p].flush(buffers[p], index, T)
+                        full_queue[p].put(index)
 
     except KeyboardInterrupt:
         pass  
@@ -183,25 +336,65 @@ def act(i, device, free_queue, full_queue, model, buffers, flags):
         print()
         raise e
 
-def _cards2tensor(list_cards):
+class Rollout(object):
     """
-    Convert a list of integers to the tensor
-    representation
-    See Figure 2 in https://arxiv.org/pdf/2106.06135.pdf
+    The trajectory of a position in an environment of an actor,
+    in preallocated arrays with the same keys as the buffers. The
+    steps are written in place, and an unroll is copied into a
+    buffer slot with one `copy_` per key. The arrays grow if a
+    trajectory does not fit, which is rare since the unrolls are
+    flushed at the end of every game.
     """
-    if len(list_cards) == 0:
-        return torch.zeros(54, dtype=torch.int8)
-
-    matrix = np.zeros([4, 13], dtype=np.int8)
-    jokers = np.zeros(2, dtype=np.int8)
-    counter = Counter(list_cards)
-    for card, num_times in counter.items():
-        if card < 20:
-            matrix[:, Card2Column[card]] = NumOnes2Array[num_times]
-        elif card == 20:
-            jokers[0] = 1
-        elif card == 30:
-            jokers[1] = 1
-    matrix = np.concatenate((matrix.flatten('F'), jokers))
-    matrix = torch.from_numpy(matrix)
-    return matrix
+    def __init__(self, position, capacity):
+        x_dim = 319 if position == 'landlord' else 430
+        self.arrays = dict(
+            done=np.zeros(capacity, dtype=np.bool_),
+            episode_return=np.zeros(capacity, dtype=np.float32),
+            target=np.zeros(capacity, dtype=np.float32),
+            obs_x_no_action=np.zeros((capacity, x_dim), dtype=np.int8),
+            obs_action=np.zeros((capacity, 54), dtype=np.int8),
+            obs_z=np.zeros((capacity, 5, 162), dtype=np.int8),
+        )
+        # The number of steps, and of the steps of finished games
+        self.size = 0
+        self.num_targets = 0
+
+    def add_obs(self, x_no_action, z):
+        if self.size == len(self.arrays['done']):
+            for key, array in self.arrays.items():
+                self.arrays[key] = np.concatenate([array, np.zeros_like(array)])
+        self.arrays['obs_x_no_action'][self.size] = x_no_action
+        self.arrays['obs_z'][self.size] = z
+
+    def add_action(self, action):
+        """
+        The action of the observation of the last `add_obs`
+        See Figure 2 in https://arxiv.org/pdf/2106.06135.pdf
+        """
+        self.arrays['obs_action'][self.size] = encoding.cards2array(action)
+        self.size += 1
+
+    def end_game(self, episode_return):
+        """
+        Fill in the returns and targets of the steps of the game
+        """
+        start, end = self.num_targets, self.size
+        if end == start:
+            return
+        self.arrays['done'][start:end] = False
+        self.arrays['done'][end - 1] = True
+        self.arrays['episode_return'][start:end] = 0.0
+        self.arrays['episode_return'][end - 1] = episode_return
+        self.arrays['target'][start:end] = episode_return
+        self.num_targets = end
+
+    def flush(self, buffers, index, T):
+        """
+        Copy the first `T` steps into the buffer slot `index`,
+        and move the rest to the front
+        """
+        for key, array in self.arrays.items():
+            buffers[key][index].copy_(torch.from_numpy(array[:T]))
+            array[:self.size - T] = array[T:self.size]
+        self.size -= T
+        self.num_targets -= T
@@ -0,0 +1,135 @@
+"""
+The broadcast of the learner weights to the actors. Instead of
+copying the weights into the shared actor models after every
+learning step, the learner publishes a new version every
+`--weight_sync_steps` steps or `--weight_sync_interval` seconds.
+The weights are copied into a staging model while the learner
+holds the lock of the position, and from there into the actor
+models of every device after the lock is released. The actors act
+with local copies, and pick up the new versions between games. The
+version of a position is odd while it is being written, and an actor
+copies again if it changed during the copy, so an actor never acts
+with a half-written copy.
+"""
+import copy
+import threading
+import time
+
+import torch
+
+positions = ['landlord', 'landlord_up', 'landlord_down']
+
+class WeightBroadcast(object):
+    """
+    The learner side. `num_readers` is the number of actors and
+    inference servers, each of which gets a reader with `reader`.
+    """
+    def __init__(self, flags, num_readers):
+        # Twice the published version, plus one while publishing
+        self.versions = torch.zeros(len(positions), dtype=torch.int64).share_memory_()
+        # The version used by every reader, -1 for
+        # the positions that a reader does not use
+        self.reader_versions = torch.zeros(num_readers, len(positions),
+                                           dtype=torch.int64).share_memory_()
+        self.num_readers = num_readers
+        self.next_reader = 0
+        self.sync_steps = flags.weight_sync_steps
+        self.sync_interval = flags.weight_sync_interval
+        self.steps = {p: 0 for p in positions}
+        self.last_sync_time = {p: time.time() for p in positions}
+        # The weights to publish, and whether they are being published
+        self.staging = {}
+        self.publish_locks = {p: threading.Lock() for p in positions}
+
+    def step(self, position, model):
+        """
+        Called after every learning step of a position, with the
+        lock of the position held. If it is time to publish, copy
+        the weights of `model` to the staging model and return True,
+        in which case the caller should call `publish` next, after
+        releasing the lock.
+        """
+        self.steps[position] += 1
+        if self.steps[position] < self.sync_steps and \
+                time.time() - self.last_sync_time[position] < self.sync_interval:
+            return False
+        if not self.publish_locks[position].acquire(blocking=False):
+            # The last version is still being published,
+            # so try again after the next step
+            return False
+        if position not in self.staging:
+            self.staging[position] = copy.deepcopy(model).requires_grad_(False)
+        self.staging[position].load_state_dict(model.state_dict())
+        self.steps[position] = 0
+        self.last_sync_time[position] = time.time()
+        return True
+
+    def publish(self, position, actor_models):
+        """
+        Copy the staging weights of a position to the shared actor
+        models of every device, see `step`
+        """
+        try:
+            k = positions.index(position)
+            self.versions[k] += 1
+            state_dict = self.staging[position].state_dict()
+            for actor_model in actor_models.values():
+                actor_model.get_model(position).load_state_dict(state_dict)
+            self.versions[k] += 1
+        finally:
+            self.publish_locks[position].release()
+
+    def reader(self, reader_positions=positions):
+        """
+        The reader of a new actor or inference server, which uses
+        the weights of `reader_positions`
+        """
+        assert self.next_reader < self.num_readers, 'Not enough readers'
+        for k, position in enumerate(positions):
+            if position not in reader_positions:
+                self.reader_versions[self.next_reader, k] = -1
+        reader = WeightReader(self.versions, self.reader_versions[self.next_reader])
+        self.next_reader += 1
+        return reader
+
+    def policy_lag(self):
+        """
+        The mean and the largest number of versions by which
+        the readers are behind the learner, per position
+        """
+        stats = {}
+        for k, position in enumerate(positions):
+            reader_versions = self.reader_versions[:, k]
+            lag = self.versions[k] // 2 - reader_versions[reader_versions >= 0]
+            if len(lag) > 0:
+                stats['policy_lag_mean_' + position] = float(lag.double().mean())
+                stats['policy_lag_max_' + position] = int(lag.max())
+        return stats
+
+class WeightReader(object):
+    """
+    The actor side, see `WeightBroadcast.reader`
+    """
+    def __init__(self, versions, reader_versions):
+        self.versions = versions
+        self.reader_versions = reader_versions
+
+    def refresh(self, position, shared_model, local_model):
+        """
+        Copy the weights of a position from the shared model to
+        the local one if there is a new version. Return whether
+        they were copied. If a version is being published, or is
+        published again while copying, it waits and copies again,
+        so the local model is always one whole version.
+        """
+        k = positions.index(position)
+        while True:
+            version = int(self.versions[k])
+            if version % 2 == 0:
+                if version // 2 == int(self.reader_versions[k]):
+                    return False
+                local_model.load_state_dict(shared_model.state_dict())
+                if int(self.versions[k]) == version:
+                    self.reader_versions[k] = version // 2
+                    return True
+            time.sleep(0.001)
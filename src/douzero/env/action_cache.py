@@ -0,0 +1,62 @@
+"""
+A bounded cache of legal actions. The same pairs of hand
+and rival move show up over and over across self-play games,
+so the legal actions can be memoized instead of generating
+them from scratch every time.
+"""
+import collections
+
+class LegalActionCache(object):
+    """
+    A least recently used cache that maps a hand and a rival
+    move to the legal actions. The keys are hashable, and the
+    cached legal actions are stored as a tuple of tuples so
+    that callers can not corrupt the cache by modifying them.
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+
+    @staticmethod
+    def make_key(hand_bits, rival_move):
+        """
+        The hand is a card set (see cardset.py), which is
+        already canonical. The rival move is kept as it is
+        since the move type depends on the order of the cards.
+        """
+        return hand_bits, tuple(rival_move)
+
+    def get(self, key, gen_moves):
+        """
+        Return the legal actions for `key`. On a miss, they
+        are generated by calling `gen_moves()`.
+        """
+        moves = self._cache.get(key)
+        if moves is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return moves
+
+        self.misses += 1
+        moves = tuple(tuple(move) for move in gen_moves())
+        self._cache[key] = moves
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return moves
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'hit_rate': self.hits / total if total > 0 else 0.0}
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,106 @@
+"""
+Card sets packed into a single integer. Each of the 13 normal
+ranks takes 4 bits, where n cards of the rank are encoded as n
+ones, and the two jokers take one bit each. That is, bit i is
+exactly entry i of the 54-dim card encoding used by the
+features (see Figure 2 in https://arxiv.org/pdf/2106.06135.pdf).
+With this layout, adding or removing a card, counting the cards
+and checking whether a set is contained in another are all O(1).
+
+The card sets are plain integers, so they are immutable and
+hashable. Lists of cards are only needed at the API edge.
+"""
+
+EMPTY = 0
+
+# All the 54 cards
+FULL = (1 << 54) - 1
+
+# The lowest bit of each rank
+Card2Shift = {3: 0, 4: 4, 5: 8, 6: 12, 7: 16, 8: 20, 9: 24, 10: 28,
+              11: 32, 12: 36, 13: 40, 14: 44, 17: 48, 20: 52, 30: 53}
+
+# The bits of each rank
+Card2Mask = {card: (0x1 if card in (20, 30) else 0xF) << shift
+             for card, shift in Card2Shift.items()}
+
+# The ones of each rank are the lowest bits, so n ones
+# can be mapped back to n cards
+_Field2Cards = {card: {field: [card] * bin(field).count('1')
+                       for field in (0x0, 0x1, 0x3, 0x7, 0xF)}
+                for card in Card2Shift}
+
+def add_card(bits, card):
+    shift = Card2Shift[card]
+    field = (bits & Card2Mask[card]) >> shift
+    if field == Card2Mask[card] >> shift:
+        raise ValueError('too many cards of rank {}'.format(card))
+    return bits | ((field + 1) << shift)
+
+def remove_card(bits, card):
+    """
+    Remove one card. It raises ValueError if the card is not
+    in the set, same as list.remove.
+    """
+    shift = Card2Shift[card]
+    field = (bits & Card2Mask[card]) >> shift
+    if field == 0:
+        raise ValueError('card {} is not in the set'.format(card))
+    return bits ^ ((field ^ (field >> 1)) << shift)
+
+def add_cards(bits, list_cards):
+    for card in list_cards:
+        bits = add_card(bits, card)
+    return bits
+
+def remove_cards(bits, list_cards):
+    for card in list_cards:
+        bits = remove_card(bits, card)
+    return bits
+
+def cards2bits(list_cards):
+    """
+    Convert a list of integers into a card set
+    """
+    return add_cards(EMPTY, list_cards)
+
+def bits2cards(bits):
+    """
+    Convert a card set into a sorted list of integers
+    """
+    list_cards = []
+    for card, shift in Card2Shift.items():
+        if bits & Card2Mask[card]:
+            list_cards.extend(
+                _Field2Cards[card][(bits & Card2Mask[card]) >> shift])
+    return list_cards
+
+def union(bits, other_bits):
+    """
+    The multiset union, i.e., the cards of both sets
+    """
+    for card, shift in Card2Shift.items():
+        other_field = (other_bits & Card2Mask[card]) >> shift
+        if other_field:
+            field = (bits & Card2Mask[card]) >> shift
+            num_cards = bin(other_field).count('1')
+            bits |= (((field + 1) << num_cards) - 1) << shift
+    return bits
+
+def issubset(bits, other_bits):
+    """
+    Whether all the cards of `bits` are in `other_bits`
+    """
+    return bits & ~other_bits == 0
+
+def count(bits):
+    """
+    The number of cards in the set
+    """
+    return bin(bits).count('1')
+
+def rank_count(bits, card):
+    """
+    The number of cards of the given rank
+    """
+    return bin(bits & Card2Mask[card]).count('1')
@@ -0,0 +1,75 @@
+"""
+The 54-dim card encoding shared by the features and the
+training buffers (see Figure 2 in https://arxiv.org/pdf/2106.06135.pdf).
+The encoding of a list of cards is the bits of its card set (see
+cardset.py), so a batch of moves can be encoded with one
+`np.unpackbits` instead of filling a matrix card by card.
+
+The moves are played over and over, so their card sets and
+encodings are cached. The cached encodings are read-only.
+"""
+import numpy as np
+
+from douzero.env import cardset as cs
+
+# Both caches are keyed by the move as a tuple. They stay small,
+# since the moves are drawn from the same ~30000 patterns.
+_move_bits = {}
+_move_arrays = {}
+
+def cards2bits(list_cards):
+    """
+    The card set of a list of cards, cached by the list
+    """
+    key = tuple(list_cards)
+    bits = _move_bits.get(key)
+    if bits is None:
+        bits = cs.cards2bits(list_cards)
+        _move_bits[key] = bits
+    return bits
+
+def bits2array(bits):
+    """
+    The int8 encoding of a card set. The bits of a card
+    set are exactly the 54 entries.
+    """
+    return np.unpackbits(
+        np.frombuffer(bits.to_bytes(7, 'little'), dtype=np.uint8),
+        count=54, bitorder='little').view(np.int8)
+
+def bits2arrays(bits, out=None):
+    """
+    The batched version of `bits2array`. `bits` is an array
+    of card sets of any shape, and one more axis of size 54
+    is added to the result. If `out` is given, the result is
+    written into it.
+    """
+    bits = np.asarray(bits, dtype='<u8')
+    arrays = np.unpackbits(bits[..., np.newaxis].view(np.uint8), axis=-1,
+                           count=54, bitorder='little').view(np.int8)
+    if out is None:
+        return arrays
+    out[...] = arrays
+    return out
+
+def cards2array(list_cards):
+    """
+    The int8 encoding of a list of cards. The result is
+    cached and must not be modified.
+    """
+    key = tuple(list_cards)
+    array = _move_arrays.get(key)
+    if array is None:
+        array = bits2array(cards2bits(key))
+        array.flags.writeable = False
+        _move_arrays[key] = array
+    return array
+
+def cards2arrays(list_moves, out=None):
+    """
+    Encode a list of moves into an (N, 54) array, or into
+    `out` if it is given, e.g., a slice of a larger array.
+    """
+    bits = np.fromiter((cards2bits(move) for move in list_moves),
+                       dtype=np.uint64, count=len(list_moves))
+    return bits2arrays(bits, out=out)
@@ -1,17 +1,8 @@
-from collections import Counter
 import numpy as np
 
+from douzero.env import encoding
 from douzero.env.game import GameEnv
 
-Card2Column = {3: 0, 4: 1, 5: 2, 6: 3, 7: 4, 8: 5, 9: 6, 10: 7,
-               11: 8, 12: 9, 13: 10, 14: 11, 17: 12}
-
-NumOnes2Array = {0: np.array([0, 0, 0, 0]),
-                 1: np.array([1, 0, 0, 0]),
-                 2: np.array([1, 1, 0, 0]),
-                 3: np.array([1, 1, 1, 0]),
-                 4: np.array([1, 1, 1, 1])}
-
 deck = []
 for i in range(3, 15):
     deck.extend([i for _ in range(4)])
@@ -22,7 +13,9 @@ class Env:
     """
     Doudizhu multi-agent wrapper
     """
-    def __init__(self, objective):
+    def __init__(self, objective, use_move_table=False,
+                 legal_action_cache=None, deepcopy_infoset=False,
+                 compact_obs=False, build_obs=True):
         """
         Objective is wp/adp/logadp. It indicates whether considers
         bomb in reward calculation. Here, we use dummy agents.
@@ -33,8 +26,21 @@ class Env:
         to play. For each move, we tell the corresponding
         dummy player which action to play, then the player
         will perform the actual action in the game engine.
+        If `use_move_table` is set, the legal leads are obtained
+        from the precomputed move table. `legal_action_cache`
+        is an optional LegalActionCache for the legal actions.
+        `deepcopy_infoset` is a debug option that gives deep copies
+        of the infosets instead of snapshots. If `compact_obs` is
+        set, the observations are given by `get_compact_obs`
+        instead of `get_obs`. If `build_obs` is not set, `reset` and
+        `step` return None as the observation, and the caller builds
+        it from `infoset`, e.g., with `get_obs_batch` for the
+        infosets of several environments.
         """
         self.objective = objective
+        self.compact_obs = compact_obs
+        self.build_obs = build_obs
+        self.legal_action_cache = legal_action_cache
 
         # Initialize players
         # We use three dummy player for the target position
@@ -43,7 +49,10 @@ class Env:
             self.players[position] = DummyAgent(position)
 
         # Initialize the internal environment
-        self._env = GameEnv(self.players)
+        self._env = GameEnv(self.players,
+                            use_move_table=use_move_table,
+                            legal_action_cache=legal_action_cache,
+                            deepcopy_infoset=deepcopy_infoset)
 
         self.infoset = None
 
@@ -70,7 +79,7 @@ class Env:
         self._env.card_play_init(card_play_data)
         self.infoset = self._game_infoset
 
-        return get_obs(self.infoset)
+        return self._get_obs()
 
     def step(self, action):
         """
@@ -91,9 +100,16 @@ class Env:
             reward = self._get_reward()
             obs = None
         else:
-            obs = get_obs(self.infoset)
+            obs = self._get_obs()
         return obs, reward, done, {}
 
+    def _get_obs(self):
+        if not self.build_obs:
+            return None
+        if self.compact_obs:
+            return get_compact_obs(self.infoset)
+        return get_obs(self.infoset)
+
     def _get_reward(self):
         """
         This function is called in the end of each
@@ -227,28 +243,6 @@ def _get_one_hot_array(num_left_cards, max_num_cards):
 
     return one_hot
 
-def _cards2array(list_cards):
-    """
-    A utility function that transforms the actions, i.e.,
-    A list of integers into card matrix. Here we remove
-    the six entries that are always zero and flatten the
-    the representations.
-    """
-    if len(list_cards) == 0:
-        return np.zeros(54, dtype=np.int8)
-
-    matrix = np.zeros([4, 13], dtype=np.int8)
-    jokers = np.zeros(2, dtype=np.int8)
-    counter = Counter(list_cards)
-    for card, num_times in counter.items():
-        if card < 20:
-            matrix[:, Card2Column[card]] = NumOnes2Array[num_times]
-        elif card == 20:
-            jokers[0] = 1
-        elif card == 30:
-            jokers[1] = 1
-    return np.concatenate((matrix.flatten('F'), jokers))
-
 def _action_seq_list2array(action_seq_list):
     """
     A utility function to encode the historical moves.
@@ -259,9 +253,7 @@ def _action_seq_list2array(action_seq_list):
     Finally, we obtain a 5x162 matrix, which will be fed
     into LSTM for encoding.
     """
-    action_seq_array = np.zeros((len(action_seq_list), 54))
-    for row, list_cards in enumerate(action_seq_list):
-        action_seq_array[row, :] = _cards2array(list_cards)
+    action_seq_array = encoding.cards2arrays(action_seq_list)
     action_seq_array = action_seq_array.reshape(5, 162)
     return action_seq_array
 
@@ -293,21 +285,19 @@ def _get_obs_landlord(infoset):
     https://arxiv.org/pdf/2106.06135.pdf
     """
     num_legal_actions = len(infoset.legal_actions)
-    my_handcards = _cards2array(infoset.player_hand_cards)
+    my_handcards = encoding.bits2array(infoset.player_hand_bits)
     my_handcards_batch = np.repeat(my_handcards[np.newaxis, :],
                                    num_legal_actions, axis=0)
 
-    other_handcards = _cards2array(infoset.other_hand_cards)
+    other_handcards = encoding.bits2array(infoset.other_hand_bits)
     other_handcards_batch = np.repeat(other_handcards[np.newaxis, :],
                                       num_legal_actions, axis=0)
 
-    last_action = _cards2array(infoset.last_move)
+    last_action = encoding.cards2array(infoset.last_move)
     last_action_batch = np.repeat(last_action[np.newaxis, :],
                                   num_legal_actions, axis=0)
 
-    my_action_batch = np.zeros(my_handcards_batch.shape)
-    for j, action in enumerate(infoset.legal_actions):
-        my_action_batch[j, :] = _cards2array(action)
+    my_action_batch = encoding.cards2arrays(infoset.legal_actions)
 
     landlord_up_num_cards_left = _get_one_hot_array(
         infoset.num_cards_left_dict['landlord_up'], 17)
@@ -321,14 +311,14 @@ def _get_obs_landlord(infoset):
         landlord_down_num_cards_left[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    landlord_up_played_cards = _cards2array(
-        infoset.played_cards['landlord_up'])
+    landlord_up_played_cards = encoding.bits2array(
+        infoset.played_bits['landlord_up'])
     landlord_up_played_cards_batch = np.repeat(
         landlord_up_played_cards[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    landlord_down_played_cards = _cards2array(
-        infoset.played_cards['landlord_down'])
+    landlord_down_played_cards = encoding.bits2array(
+        infoset.played_bits['landlord_down'])
     landlord_down_played_cards_batch = np.repeat(
         landlord_down_played_cards[np.newaxis, :],
         num_legal_actions, axis=0)
@@ -377,23 +367,21 @@ def _get_obs_landlord_up(infoset):
     https://arxiv.org/pdf/2106.06135.pdf
     """
     num_legal_actions = len(infoset.legal_actions)
-    my_handcards = _cards2array(infoset.player_hand_cards)
+    my_handcards = encoding.bits2array(infoset.player_hand_bits)
     my_handcards_batch = np.repeat(my_handcards[np.newaxis, :],
                                    num_legal_actions, axis=0)
 
-    other_handcards = _cards2array(infoset.other_hand_cards)
+    other_handcards = encoding.bits2array(infoset.other_hand_bits)
     other_handcards_batch = np.repeat(other_handcards[np.newaxis, :],
                                       num_legal_actions, axis=0)
 
-    last_action = _cards2array(infoset.last_move)
+    last_action = encoding.cards2array(infoset.last_move)
     last_action_batch = np.repeat(last_action[np.newaxis, :],
                                   num_legal_actions, axis=0)
 
-    my_action_batch = np.zeros(my_handcards_batch.shape)
-    for j, action in enumerate(infoset.legal_actions):
-        my_action_batch[j, :] = _cards2array(action)
+    my_action_batch = encoding.cards2arrays(infoset.legal_actions)
 
-    last_landlord_action = _cards2array(
+    last_landlord_action = encoding.cards2array(
         infoset.last_move_dict['landlord'])
     last_landlord_action_batch = np.repeat(
         last_landlord_action[np.newaxis, :],
@@ -404,13 +392,13 @@ def _get_obs_landlord_up(infoset):
         landlord_num_cards_left[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    landlord_played_cards = _cards2array(
-        infoset.played_cards['landlord'])
+    landlord_played_cards = encoding.bits2array(
+        infoset.played_bits['landlord'])
     landlord_played_cards_batch = np.repeat(
         landlord_played_cards[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    last_teammate_action = _cards2array(
+    last_teammate_action = encoding.cards2array(
         infoset.last_move_dict['landlord_down'])
     last_teammate_action_batch = np.repeat(
         last_teammate_action[np.newaxis, :],
@@ -421,8 +409,8 @@ def _get_obs_landlord_up(infoset):
         teammate_num_cards_left[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    teammate_played_cards = _cards2array(
-        infoset.played_cards['landlord_down'])
+    teammate_played_cards = encoding.bits2array(
+        infoset.played_bits['landlord_down'])
     teammate_played_cards_batch = np.repeat(
         teammate_played_cards[np.newaxis, :],
         num_legal_actions, axis=0)
@@ -475,23 +463,21 @@ def _get_obs_landlord_down(infoset):
     https://arxiv.org/pdf/2106.06135.pdf
     """
     num_legal_actions = len(infoset.legal_actions)
-    my_handcards = _cards2array(infoset.player_hand_cards)
+    my_handcards = encoding.bits2array(infoset.player_hand_bits)
     my_handcards_batch = np.repeat(my_handcards[np.newaxis, :],
                                    num_legal_actions, axis=0)
 
-    other_handcards = _cards2array(infoset.other_hand_cards)
+    other_handcards = encoding.bits2array(infoset.other_hand_bits)
     other_handcards_batch = np.repeat(other_handcards[np.newaxis, :],
                                       num_legal_actions, axis=0)
 
-    last_action = _cards2array(infoset.last_move)
+    last_action = encoding.cards2array(infoset.last_move)
     last_action_batch = np.repeat(last_action[np.newaxis, :],
                                   num_legal_actions, axis=0)
 
-    my_action_batch = np.zeros(my_handcards_batch.shape)
-    for j, action in enumerate(infoset.legal_actions):
-        my_action_batch[j, :] = _cards2array(action)
+    my_action_batch = encoding.cards2arrays(infoset.legal_actions)
 
-    last_landlord_action = _cards2array(
+    last_landlord_action = encoding.cards2array(
         infoset.last_move_dict['landlord'])
     last_landlord_action_batch = np.repeat(
         last_landlord_action[np.newaxis, :],
@@ -502,13 +488,13 @@ def _get_obs_landlord_down(infoset):
         landlord_num_cards_left[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    landlord_played_cards = _cards2array(
-        infoset.played_cards['landlord'])
+    landlord_played_cards = encoding.bits2array(
+        infoset.played_bits['landlord'])
     landlord_played_cards_batch = np.repeat(
         landlord_played_cards[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    last_teammate_action = _cards2array(
+    last_teammate_action = encoding.cards2array(
         infoset.last_move_dict['landlord_up'])
     last_teammate_action_batch = np.repeat(
         last_teammate_action[np.newaxis, :],
@@ -519,14 +505,14 @@ def _get_obs_landlord_down(infoset):
         teammate_num_cards_left[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    teammate_played_cards = _cards2array(
-        infoset.played_cards['landlord_up'])
+    teammate_played_cards = encoding.bits2array(
+        infoset.played_bits['landlord_up'])
     teammate_played_cards_batch = np.repeat(
         teammate_played_cards[np.newaxis, :],
         num_legal_actions, axis=0)
 
-    landlord_played_cards = _cards2array(
-        infoset.played_cards['landlord'])
+    landlord_played_cards = encoding.bits2array(
+        infoset.played_bits['landlord'])
     landlord_played_cards_batch = np.repeat(
         landlord_played_cards[np.newaxis, :],
         num_legal_actions, axis=0)
@@ -572,3 +558,185 @@ def _get_obs_landlord_down(infoset):
             'z': z.astype(np.int8),
           }
     return obs
+
+# The features of each position in the same order as `_get_obs_*`.
+# `cards` are the card features, given as the infoset field and the
+# key of the field if it is a dict, and `num_cards_left` are the
+# positions whose number of cards left are encoded, together with
+# the maximum number of cards.
+_ObsSpecs = {
+    'landlord': {
+        'cards': [('player_hand_bits', None),
+                  ('other_hand_bits', None),
+                  ('last_move', None),
+                  ('played_bits', 'landlord_up'),
+                  ('played_bits', 'landlord_down')],
+        'num_cards_left': [('landlord_up', 17),
+                           ('landlord_down', 17)],
+    },
+    'landlord_up': {
+        'cards': [('player_hand_bits', None),
+                  ('other_hand_bits', None),
+                  ('played_bits', 'landlord'),
+                  ('played_bits', 'landlord_down'),
+                  ('last_move', None),
+                  ('last_move_dict', 'landlord'),
+                  ('last_move_dict', 'landlord_down')],
+        'num_cards_left': [('landlord', 20),
+                           ('landlord_down', 17)],
+    },
+    'landlord_down': {
+        'cards': [('player_hand_bits', None),
+                  ('other_hand_bits', None),
+                  ('played_bits', 'landlord'),
+                  ('played_bits', 'landlord_up'),
+                  ('last_move', None),
+                  ('last_move_dict', 'landlord'),
+                  ('last_move_dict', 'landlord_up')],
+        'num_cards_left': [('landlord', 20),
+                           ('landlord_up', 17)],
+    },
+}
+
+def _get_card_feature_bits(infoset, field, key):
+    value = getattr(infoset, field)
+    if key is not None:
+        value = value[key]
+    if isinstance(value, int):
+        return value
+    return encoding.cards2bits(value)
+
+def get_compact_obs(infoset):
+    """
+    An alternative to `get_obs` that does not broadcast the state
+    features over the legal actions. Only the action features differ
+    between the rows of `x_batch`, so the observation is given as:
+
+    `x_no_action` and `z`: the state features, the same as in `get_obs`.
+
+    `x_action`: an int8 matrix with the features of each legal action,
+    one row per action.
+
+    `legal_actions`: the legal moves.
+
+    The models expand it into the `x_batch` rows on the device, see
+    `forward` in models.py. `get_obs` is kept for compatibility.
+    """
+    if infoset.player_position not in _ObsSpecs:
+        raise ValueError('')
+    x_no_action, z = _get_state_features(infoset.player_position, [infoset])
+    return {
+            'position': infoset.player_position,
+            'x_no_action': x_no_action[0],
+            'x_action': encoding.cards2arrays(infoset.legal_actions),
+            'legal_actions': infoset.legal_actions,
+            'z': z[0],
+           }
+
+def get_obs_batch(infosets, compact=False):
+    """
+    The batched version of `get_obs`. It takes a list of infosets,
+    which can come from different games and positions, and builds
+    the features of all of them at once with array indexing.
+
+    Since the positions have different features, the infosets are
+    grouped by position. The result is a dict that maps each position
+    in the batch to the features of its infosets:
+
+    `indices`: the indices of the infosets in `infosets`.
+
+    `x_batch` and `z_batch`: the rows of all the legal actions of all
+    the infosets, concatenated. The rows of the i-th infoset are
+    `offsets[i]:offsets[i + 1]`, and they are the same as the
+    `x_batch` and `z_batch` of `get_obs`. If `compact` is set, they
+    are replaced by `x_action`, the concatenated action features of
+    `get_compact_obs`.
+
+    `legal_actions`, `x_no_action` and `z`: one per infoset, the same
+    as in `get_obs`.
+    """
+    indices = {}
+    for index, infoset in enumerate(infosets):
+        if infoset.player_position not in _ObsSpecs:
+            raise ValueError('')
+        indices.setdefault(infoset.player_position, []).append(index)
+
+    obs_batch = {}
+    for position, position_indices in indices.items():
+        obs = _get_obs_batch(position,
+                             [infosets[index] for index in position_indices],
+                             compact)
+        obs['indices'] = np.array(position_indices, dtype=np.int64)
+        obs_batch[position] = obs
+    return obs_batch
+
+def _get_state_features(position, infosets):
+    """
+    The `x_no_action` and `z` of the infosets of a position,
+    with one row per infoset
+    """
+    spec = _ObsSpecs[position]
+    num_infosets = len(infosets)
+    num_card_features = len(spec['cards'])
+
+    card_bits = [[_get_card_feature_bits(infoset, field, key)
+                  for field, key in spec['cards']]
+                 for infoset in infosets]
+    card_features = encoding.bits2arrays(card_bits).reshape(num_infosets, -1)
+
+    num_features = num_card_features * 54 + \
+        sum(max_num_cards for _, max_num_cards in spec['num_cards_left']) + 15
+    x_no_action = np.zeros((num_infosets, num_features), dtype=np.int8)
+    x_no_action[:, :num_card_features * 54] = card_features
+
+    rows = np.arange(num_infosets)
+    column = num_card_features * 54
+    for pos, max_num_cards in spec['num_cards_left']:
+        num_cards_left = np.array(
+            [infoset.num_cards_left_dict[pos] for infoset in infosets])
+        # Same as the negative index in `_get_one_hot_array`
+        x_no_action[rows, column + (num_cards_left - 1) % max_num_cards] = 1
+        column += max_num_cards
+    bomb_num = np.array([infoset.bomb_num for infoset in infosets])
+    x_no_action[rows, column + bomb_num] = 1
+
+    action_seq_bits = [[encoding.cards2bits(move)
+                        for move in _process_action_seq(
+                            infoset.card_play_action_seq)]
+                       for infoset in infosets]
+    z = encoding.bits2arrays(action_seq_bits).reshape(num_infosets, 5, 162)
+    return x_no_action, z
+
+def _get_obs_batch(position, infosets, compact=False):
+    num_infosets = len(infosets)
+    x_no_action, z = _get_state_features(position, infosets)
+    num_features = x_no_action.shape[1]
+
+    legal_actions = [infoset.legal_actions for infoset in infosets]
+    num_legal_actions = np.array([len(actions) for actions in legal_actions],
+                                 dtype=np.int64)
+    offsets = np.zeros(num_infosets + 1, dtype=np.int64)
+    np.cumsum(num_legal_actions, out=offsets[1:])
+    action_bits = np.fromiter((encoding.cards2bits(action)
+                               for actions in legal_actions
+                               for action in actions),
+                              dtype=np.uint64, count=offsets[-1])
+
+    obs = {
+            'position': position,
+            'offsets': offsets,
+            'legal_actions': legal_actions,
+            'x_no_action': x_no_action,
+            'z': z,
+          }
+    if compact:
+        obs['x_action'] = encoding.bits2arrays(action_bits)
+        return obs
+
+    action_rows = np.repeat(np.arange(num_infosets), num_legal_actions)
+    x_batch = np.empty((offsets[-1], num_features + 54), dtype=np.float32)
+    x_batch[:, :num_features] = x_no_action[action_rows]
+    encoding.bits2arrays(action_bits, out=x_batch[:, num_features:])
+    obs['x_batch'] = x_batch
+    obs['z_batch'] = z[action_rows].astype(np.float32)
+    return obs
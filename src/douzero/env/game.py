@@ -1,5 +1,8 @@
-from copy import deepcopy
+import copy
+from . import cardset as cs
 from . import move_detector as md, move_selector as ms
+from . import move_table as mt
+from .legal_actions import LegalActions
 from .move_generator import MovesGener
 
 EnvCard2RealCard = {3: '3', 4: '4', 5: '5', 6: '6', 7: '7',
@@ -17,7 +20,8 @@ bombs = [[3, 3, 3, 3], [4, 4, 4, 4], [5, 5, 5, 5], [6, 6, 6, 6],
 
 class GameEnv(object):
 
-    def __init__(self, players):
+    def __init__(self, players, use_move_table=False, legal_action_cache=None,
+                 deepcopy_infoset=False):
 
         self.card_play_action_seq = []
 
@@ -33,9 +37,9 @@ class GameEnv(object):
                                'landlord_up': [],
                                'landlord_down': []}
 
-        self.played_cards = {'landlord': [],
-                             'landlord_up': [],
-                             'landlord_down': []}
+        self.played_bits = {'landlord': cs.EMPTY,
+                            'landlord_up': cs.EMPTY,
+                            'landlord_down': cs.EMPTY}
 
         self.last_move = []
         self.last_two_moves = []
@@ -53,6 +57,21 @@ class GameEnv(object):
         self.bomb_num = 0
         self.last_pid = 'landlord'
 
+        # Whether to generate the leads from the precomputed
+        # move table (see move_table.py) instead of MovesGener.
+        # The moves are the same but come in a different order.
+        self.use_move_table = use_move_table
+
+        # An optional LegalActionCache (see action_cache.py). It
+        # can be shared by the environments of the same process,
+        # as long as they use the same `use_move_table` setting.
+        self.legal_action_cache = legal_action_cache
+
+        # Whether the infoset given to the players is a deep copy
+        # instead of a snapshot (see InfoSet.snapshot). This is only
+        # meant for debugging players that modify the infoset.
+        self.deepcopy_infoset = deepcopy_infoset
+
     def card_play_init(self, card_play_data):
         self.info_sets['landlord'].player_hand_cards = \
             card_play_data['landlord']
@@ -65,9 +84,9 @@ class GameEnv(object):
         self.game_infoset = self.get_infoset()
 
     def game_done(self):
-        if len(self.info_sets['landlord'].player_hand_cards) == 0 or \
-                len(self.info_sets['landlord_up'].player_hand_cards) == 0 or \
-                len(self.info_sets['landlord_down'].player_hand_cards) == 0:
+        if self.info_sets['landlord'].player_hand_bits == cs.EMPTY or \
+                self.info_sets['landlord_up'].player_hand_bits == cs.EMPTY or \
+                self.info_sets['landlord_down'].player_hand_bits == cs.EMPTY:
             # if one of the three players discards his hand,
             # then game is over.
             self.compute_player_utility()
@@ -77,7 +96,7 @@ class GameEnv(object):
 
     def compute_player_utility(self):
 
-        if len(self.info_sets['landlord'].player_hand_cards) == 0:
+        if self.info_sets['landlord'].player_hand_bits == cs.EMPTY:
             self.player_utility_dict = {'landlord': 2,
                                         'farmer': -1}
         else:
@@ -100,10 +119,24 @@ class GameEnv(object):
     def get_bomb_num(self):
         return self.bomb_num
 
+    @property
+    def played_cards(self):
+        """
+        The played cards of each position as sorted lists
+        """
+        return {pos: cs.bits2cards(bits)
+                for pos, bits in self.played_bits.items()}
+
     def step(self):
         action = self.players[self.acting_player_position].act(
             self.game_infoset)
+        self.apply_action(action)
 
+    def apply_action(self, action):
+        """
+        Update the game with the action of the acting player
+        and move on to the next player
+        """
         if len(action) > 0:
             self.last_pid = self.acting_player_position
 
@@ -116,7 +149,8 @@ class GameEnv(object):
         self.card_play_action_seq.append(action)
         self.update_acting_player_hand_cards(action)
 
-        self.played_cards[self.acting_player_position] += action
+        self.played_bits[self.acting_player_position] = cs.add_cards(
+            self.played_bits[self.acting_player_position], action)
 
         if self.acting_player_position == 'landlord' and \
                 len(action) > 0 and \
@@ -168,27 +202,58 @@ class GameEnv(object):
 
     def update_acting_player_hand_cards(self, action):
         if action != []:
-            for card in action:
-                self.info_sets[
-                    self.acting_player_position].player_hand_cards.remove(card)
-            self.info_sets[self.acting_player_position].player_hand_cards.sort()
+            info_set = self.info_sets[self.acting_player_position]
+            info_set.player_hand_bits = cs.remove_cards(
+                info_set.player_hand_bits, action)
 
     def get_legal_card_play_actions(self):
-        mg = MovesGener(
-            self.info_sets[self.acting_player_position].player_hand_cards)
-
-        action_sequence = self.card_play_action_seq
-
-        rival_move = []
-        if len(action_sequence) != 0:
-            if len(action_sequence[-1]) == 0:
-                rival_move = action_sequence[-2]
-            else:
-                rival_move = action_sequence[-1]
-
-        rival_type = md.get_move_type(rival_move)
-        rival_move_type = rival_type['type']
-        rival_move_len = rival_type.get('len', 1)
+        return list(self.get_legal_card_play_action_view())
+
+    def get_legal_card_play_action_view(self):
+        """
+        A lazy view of the legal actions (see legal_actions.py).
+        The moves are only generated when the view is iterated
+        or indexed.
+        """
+        player_hand_bits = \
+            self.info_sets[self.acting_player_position].player_hand_bits
+        rival_move = self.get_last_move()
+
+        if self.legal_action_cache is None:
+            count_moves = None
+            if len(rival_move) == 0 and self.use_move_table:
+                count_moves = lambda: mt.count_moves(player_hand_bits)
+            return LegalActions(
+                player_hand_bits, rival_move,
+                lambda: self._iter_legal_card_play_actions(
+                    player_hand_bits, rival_move),
+                count_moves)
+
+        key = self.legal_action_cache.make_key(player_hand_bits, rival_move)
+
+        def gen_moves():
+            moves = self.legal_action_cache.get(
+                key, lambda: self._iter_legal_card_play_actions(
+                    player_hand_bits, rival_move))
+            return (list(move) for move in moves)
+
+        return LegalActions(player_hand_bits, rival_move, gen_moves)
+
+    def _iter_legal_card_play_actions(self, player_hand_bits, rival_move):
+        """
+        Yield the legal actions in the same order as the list, i.e.,
+        the moves of the rival type, the bombs, and then pass. Each
+        group is only generated when the previous one is exhausted.
+        """
+        rival_type = md.classify_move(rival_move)
+        rival_move_type = rival_type.type
+        rival_move_len = rival_type.len if rival_type.len is not None else 1
+
+        if rival_move_type == md.TYPE_0_PASS and self.use_move_table:
+            yield from mt.gen_moves(player_hand_bits)
+            return
+
+        mg = MovesGener(cs.bits2cards(player_hand_bits))
         moves = list()
 
         if rival_move_type == md.TYPE_0_PASS:
@@ -214,52 +279,50 @@ class GameEnv(object):
             moves = []
 
         elif rival_move_type == md.TYPE_6_3_1:
-            all_moves = mg.gen_type_6_3_1()
-            moves = ms.filter_type_6_3_1(all_moves, rival_move)
+            moves = mg.gen_type_6_3_1(rival_rank=sorted(rival_move)[1])
 
         elif rival_move_type == md.TYPE_7_3_2:
-            all_moves = mg.gen_type_7_3_2()
-            moves = ms.filter_type_7_3_2(all_moves, rival_move)
+            moves = mg.gen_type_7_3_2(rival_rank=sorted(rival_move)[2])
 
         elif rival_move_type == md.TYPE_8_SERIAL_SINGLE:
-            all_moves = mg.gen_type_8_serial_single(repeat_num=rival_move_len)
-            moves = ms.filter_type_8_serial_single(all_moves, rival_move)
+            moves = mg.gen_type_8_serial_single(
+                repeat_num=rival_move_len, rival_rank=rival_move[0])
 
         elif rival_move_type == md.TYPE_9_SERIAL_PAIR:
-            all_moves = mg.gen_type_9_serial_pair(repeat_num=rival_move_len)
-            moves = ms.filter_type_9_serial_pair(all_moves, rival_move)
+            moves = mg.gen_type_9_serial_pair(
+                repeat_num=rival_move_len, rival_rank=rival_move[0])
 
         elif rival_move_type == md.TYPE_10_SERIAL_TRIPLE:
-            all_moves = mg.gen_type_10_serial_triple(repeat_num=rival_move_len)
-            moves = ms.filter_type_10_serial_triple(all_moves, rival_move)
+            moves = mg.gen_type_10_serial_triple(
+                repeat_num=rival_move_len, rival_rank=rival_move[0])
 
         elif rival_move_type == md.TYPE_11_SERIAL_3_1:
-            all_moves = mg.gen_type_11_serial_3_1(repeat_num=rival_move_len)
-            moves = ms.filter_type_11_serial_3_1(all_moves, rival_move)
+            moves = mg.gen_type_11_serial_3_1(
+                repeat_num=rival_move_len,
+                rival_rank=ms.get_triple_rank(rival_move))
 
         elif rival_move_type == md.TYPE_12_SERIAL_3_2:
-            all_moves = mg.gen_type_12_serial_3_2(repeat_num=rival_move_len)
-            moves = ms.filter_type_12_serial_3_2(all_moves, rival_move)
+            moves = mg.gen_type_12_serial_3_2(
+                repeat_num=rival_move_len,
+                rival_rank=ms.get_triple_rank(rival_move))
 
         elif rival_move_type == md.TYPE_13_4_2:
-            all_moves = mg.gen_type_13_4_2()
-            moves = ms.filter_type_13_4_2(all_moves, rival_move)
+            moves = mg.gen_type_13_4_2(rival_rank=sorted(rival_move)[2])
 
         elif rival_move_type == md.TYPE_14_4_22:
-            all_moves = mg.gen_type_14_4_22()
-            moves = ms.filter_type_14_4_22(all_moves, rival_move)
+            moves = mg.gen_type_14_4_22(rival_rank=ms.get_four_rank(rival_move))
+
+        for m in moves:
+            m.sort()
+            yield m
 
         if rival_move_type not in [md.TYPE_0_PASS,
                                    md.TYPE_4_BOMB, md.TYPE_5_KING_BOMB]:
-            moves = moves + mg.gen_type_4_bomb() + mg.gen_type_5_king_bomb()
+            yield from mg.gen_type_4_bomb()
+            yield from mg.gen_type_5_king_bomb()
 
         if len(rival_move) != 0:  # rival_move is not 'pass'
-            moves = moves + [[]]
-
-        for m in moves:
-            m.sort()
-
-        return moves
+            yield []
 
     def reset(self):
         self.card_play_action_seq = []
@@ -274,9 +337,9 @@ class GameEnv(object):
                                'landlord_up': [],
                                'landlord_down': []}
 
-        self.played_cards = {'landlord': [],
-                             'landlord_up': [],
-                             'landlord_down': []}
+        self.played_bits = {'landlord': cs.EMPTY,
+                            'landlord_up': cs.EMPTY,
+                            'landlord_down': cs.EMPTY}
 
         self.last_move = []
         self.last_two_moves = []
@@ -294,7 +357,7 @@ class GameEnv(object):
 
         self.info_sets[
             self.acting_player_position].legal_actions = \
-            self.get_legal_card_play_actions()
+            self.get_legal_card_play_action_view()
 
         self.info_sets[
             self.acting_player_position].bomb_num = self.bomb_num
@@ -309,29 +372,32 @@ class GameEnv(object):
             self.acting_player_position].last_move_dict = self.last_move_dict
 
         self.info_sets[self.acting_player_position].num_cards_left_dict = \
-            {pos: len(self.info_sets[pos].player_hand_cards)
+            {pos: cs.count(self.info_sets[pos].player_hand_bits)
              for pos in ['landlord', 'landlord_up', 'landlord_down']}
 
-        self.info_sets[self.acting_player_position].other_hand_cards = []
+        self.info_sets[self.acting_player_position].other_hand_bits = cs.EMPTY
         for pos in ['landlord', 'landlord_up', 'landlord_down']:
             if pos != self.acting_player_position:
                 self.info_sets[
-                    self.acting_player_position].other_hand_cards += \
-                    self.info_sets[pos].player_hand_cards
+                    self.acting_player_position].other_hand_bits = cs.union(
+                    self.info_sets[self.acting_player_position].other_hand_bits,
+                    self.info_sets[pos].player_hand_bits)
 
-        self.info_sets[self.acting_player_position].played_cards = \
-            self.played_cards
+        self.info_sets[self.acting_player_position].played_bits = \
+            self.played_bits
         self.info_sets[self.acting_player_position].three_landlord_cards = \
             self.three_landlord_cards
         self.info_sets[self.acting_player_position].card_play_action_seq = \
             self.card_play_action_seq
 
         self.info_sets[
-            self.acting_player_position].all_handcards = \
-            {pos: self.info_sets[pos].player_hand_cards
+            self.acting_player_position].all_hand_bits = \
+            {pos: self.info_sets[pos].player_hand_bits
              for pos in ['landlord', 'landlord_up', 'landlord_down']}
 
-        return deepcopy(self.info_sets[self.acting_player_position])
+        if self.deepcopy_infoset:
+            return copy.deepcopy(self.info_sets[self.acting_player_position])
+        return self.info_sets[self.acting_player_position].snapshot()
 
 class InfoSet(object):
     """
@@ -339,21 +405,25 @@ class InfoSet(object):
     includes all the information in the current situation,
     such as the hand cards of the three players, the
     historical moves, etc.
+    The hand cards and the played cards are stored as card
+    sets (see cardset.py), and the lists of cards are only
+    built when they are accessed.
     """
     def __init__(self, player_position):
         # The player position, i.e., landlord, landlord_down, or landlord_up
         self.player_position = player_position
-        # The hand cands of the current player. A list.
-        self.player_hand_cards = None
+        # The hand cands of the current player. A card set.
+        self.player_hand_bits = None
         # The number of cards left for each player. It is a dict with str-->int 
         self.num_cards_left_dict = None
         # The three landload cards. A list.
         self.three_landlord_cards = None
         # The historical moves. It is a list of list
         self.card_play_action_seq = None
-        # The union of the hand cards of the other two players for the current player 
-        self.other_hand_cards = None
-        # The legal actions for the current move. It is a list of list
+        # The union of the hand cards of the other two players for the current player. A card set.
+        self.other_hand_bits = None
+        # The legal actions for the current move. A lazy view that
+        # behaves like a list of list (see legal_actions.py)
         self.legal_actions = None
         # The most recent valid move
         self.last_move = None
@@ -361,11 +431,71 @@ class InfoSet(object):
         self.last_two_moves = None
         # The last moves for all the postions
         self.last_move_dict = None
-        # The played cands so far. It is a list.
-        self.played_cards = None
-        # The hand cards of all the players. It is a dict. 
-        self.all_handcards = None
+        # The played cands so far. It is a dict with str-->card set.
+        self.played_bits = None
+        # The hand cards of all the players. It is a dict with str-->card set.
+        self.all_hand_bits = None
         # Last player position that plays a valid move, i.e., not `pass`
         self.last_pid = None
         # The number of bombs played so far
         self.bomb_num = None
+
+    def snapshot(self):
+        """
+        A cheap copy of the infoset. Only the containers that the
+        game keeps modifying are copied, e.g., the action sequence
+        is copied but not the moves in it. The other fields are
+        shared with the game, so the snapshot must be treated as
+        read-only.
+        """
+        info_set = copy.copy(self)
+        info_set.card_play_action_seq = list(self.card_play_action_seq)
+        info_set.three_landlord_cards = list(self.three_landlord_cards)
+        info_set.last_move_dict = dict(self.last_move_dict)
+        info_set.played_bits = dict(self.played_bits)
+        return info_set
+
+    @property
+    def player_hand_cards(self):
+        """
+        The hand cards of the current player. A sorted list.
+        """
+        if self.player_hand_bits is None:
+            return None
+        return cs.bits2cards(self.player_hand_bits)
+
+    @player_hand_cards.setter
+    def player_hand_cards(self, list_cards):
+        if list_cards is None:
+            self.player_hand_bits = None
+        else:
+            self.player_hand_bits = cs.cards2bits(list_cards)
+
+    @property
+    def other_hand_cards(self):
+        """
+        The union of the hand cards of the other two players. A sorted list.
+        """
+        if self.other_hand_bits is None:
+            return None
+        return cs.bits2cards(self.other_hand_bits)
+
+    @property
+    def played_cards(self):
+        """
+        The played cards so far. It is a dict with str-->sorted list.
+        """
+        if self.played_bits is None:
+            return None
+        return {pos: cs.bits2cards(bits)
+                for pos, bits in self.played_bits.items()}
+
+    @property
+    def all_handcards(self):
+        """
+        The hand cards of all the players. It is a dict with str-->sorted list.
+        """
+        if self.all_hand_bits is None:
+            return None
+        return {pos: cs.bits2cards(bits)
+                for pos, bits in self.all_hand_bits.items()}
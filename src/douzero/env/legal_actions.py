@@ -0,0 +1,92 @@
+"""
+A lazy view of the legal actions. Many callers never need the
+full list of legal actions, e.g., checking whether a move typed
+in the GUI is legal, or whether there is only one legal action.
+The view generates the list on first use, and answers the
+membership tests with a hash lookup instead of a linear scan.
+"""
+from collections.abc import Sequence
+
+from . import cardset as cs
+
+class LegalActions(Sequence):
+    """
+    The legal actions of a hand against a rival move. It behaves
+    like the list returned by `GameEnv.get_legal_card_play_actions`,
+    in the same order, but the list is only built when it is
+    needed. `gen_moves()` should return an iterator of the moves,
+    and `count_moves()`, if given, should return the number of
+    moves without building them.
+    """
+    def __init__(self, hand_bits, rival_move, gen_moves, count_moves=None):
+        self.hand_bits = hand_bits
+        self.rival_move = rival_move
+        self._gen_moves = gen_moves
+        self._count_moves = count_moves
+        self._moves = None
+        self._keys = None
+
+    @classmethod
+    def from_list(cls, hand_bits, rival_move, moves):
+        legal_actions = cls(hand_bits, rival_move, None)
+        legal_actions._moves = moves
+        return legal_actions
+
+    def _materialize(self):
+        if self._moves is None:
+            self._moves = list(self._gen_moves())
+            self._gen_moves = None
+            self._count_moves = None
+        return self._moves
+
+    def stream(self):
+        """
+        Iterate over the moves without keeping the list
+        """
+        if self._moves is not None:
+            return iter(self._moves)
+        return self._gen_moves()
+
+    def is_single(self):
+        """
+        Whether there is only one legal action, e.g.,
+        the player can not beat the rival and must pass
+        """
+        if self._moves is None and self._count_moves is not None:
+            return self._count_moves() == 1
+        moves = self.stream()
+        return next(moves, None) is not None and next(moves, None) is None
+
+    def __len__(self):
+        if self._moves is None and self._count_moves is not None:
+            return self._count_moves()
+        return len(self._materialize())
+
+    def __getitem__(self, index):
+        return self._materialize()[index]
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def __contains__(self, move):
+        if len(move) == 0:
+            # Pass is legal if and only if there is a move to follow
+            return len(self.rival_move) != 0
+        try:
+            move_bits = cs.cards2bits(move)
+        except (KeyError, ValueError):
+            return False
+        if not cs.issubset(move_bits, self.hand_bits):
+            return False
+        if self._keys is None:
+            self._keys = set(tuple(m) for m in self._materialize())
+        return tuple(move) in self._keys
+
+    def __repr__(self):
+        return repr(self._materialize())
+
+    def __reduce__(self):
+        # The generator may refer to the game, so only the
+        # moves are copied or pickled
+        return (LegalActions.from_list,
+                (self.hand_bits, self.rival_move, self._materialize()))
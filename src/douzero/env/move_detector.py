@@ -10,8 +10,66 @@ def is_continuous_seq(move):
         i += 1
     return True
 
+class MoveType(collections.namedtuple('MoveType', ['type', 'rank', 'len'])):
+    """
+    The type of a move. `rank` and `len` are None if they
+    do not apply to the type.
+    """
+    __slots__ = ()
+
+    def as_dict(self):
+        """
+        The dict returned by `get_move_type`
+        """
+        move_type = {'type': self.type}
+        if self.rank is not None:
+            move_type['rank'] = self.rank
+        if self.len is not None:
+            move_type['len'] = self.len
+        return move_type
+
+_interned_move_types = {}
+
+def _intern_move_type(move_type):
+    record = MoveType(move_type['type'],
+                      move_type.get('rank'),
+                      move_type.get('len'))
+    return _interned_move_types.setdefault(record, record)
+
+_move_types = None
+
+def _build_move_types():
+    """
+    Classify all the moves in the move table, plus pass.
+    The keys are the moves as sorted tuples.
+    """
+    from douzero.env.move_table import get_move_table
+    move_types = {(): _intern_move_type(_get_move_type([]))}
+    for move in get_move_table().moves:
+        move_types[move] = _intern_move_type(_get_move_type(list(move)))
+    return move_types
+
+def classify_move(move):
+    """
+    Return the type of the move as an interned MoveType. The
+    moves that can be generated are precomputed, so this is a
+    single lookup for all the moves played in a game. Other
+    moves, e.g., invalid moves, fall back to `_get_move_type`.
+    The result is always the same as `get_move_type`.
+    """
+    global _move_types
+    if _move_types is None:
+        _move_types = _build_move_types()
+    move_type = _move_types.get(tuple(move))
+    if move_type is None:
+        move_type = _intern_move_type(_get_move_type(move))
+    return move_type
+
 # return the type of the move
 def get_move_type(move):
+    return classify_move(move).as_dict()
+
+def _get_move_type(move):
     move_size = len(move)
     move_dict = collections.Counter(move)
 
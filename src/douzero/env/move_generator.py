@@ -1,10 +1,16 @@
 from douzero.env.utils import MIN_SINGLE_CARDS, MIN_PAIRS, MIN_TRIPLES, select
+from douzero.env.move_selector import get_triple_rank
 import collections
 import itertools
 
 class MovesGener(object):
     """
-    This is for generating the possible combinations
+    This is for generating the possible combinations.
+    The generators from type 6 take an optional `rival_rank`.
+    If it is given, only the moves that beat a rival move of
+    that rank are generated, i.e., the same moves in the same
+    order as filtering with the corresponding function in
+    move_selector, but the beaten moves are never built.
     """
     def __init__(self, cards_list):
         self.cards_list = cards_list
@@ -24,10 +30,13 @@ class MovesGener(object):
         self.final_bomb_moves = []
         self.gen_type_5_king_bomb()
 
-    def _gen_serial_moves(self, cards, min_serial, repeat=1, repeat_num=0):
+    def _gen_serial_moves(self, cards, min_serial, repeat=1, repeat_num=0, rival_rank=None):
         if repeat_num < min_serial:  # at least repeat_num is min_serial
             repeat_num = 0
 
+        if rival_rank is not None:  # a chain beats the rival if its lowest card does
+            cards = [i for i in cards if i > rival_rank]
+
         single_cards = sorted(list(set(cards)))
         seq_records = list()
         moves = list()
@@ -104,45 +113,65 @@ class MovesGener(object):
             self.final_bomb_moves.append([20, 30])
         return self.final_bomb_moves
 
-    def gen_type_6_3_1(self):
+    def _triple_cards_above(self, rival_rank):
+        if rival_rank is None:
+            return self.triple_cards_moves
+        return [i for i in self.triple_cards_moves if i[0] > rival_rank]
+
+    def gen_type_6_3_1(self, rival_rank=None):
         result = []
+        triple_cards_moves = self._triple_cards_above(rival_rank)
         for t in self.single_card_moves:
-            for i in self.triple_cards_moves:
+            for i in triple_cards_moves:
                 if t[0] != i[0]:
                     result.append(t+i)
         return result
 
-    def gen_type_7_3_2(self):
+    def gen_type_7_3_2(self, rival_rank=None):
         result = list()
+        triple_cards_moves = self._triple_cards_above(rival_rank)
         for t in self.pair_moves:
-            for i in self.triple_cards_moves:
+            for i in triple_cards_moves:
                 if t[0] != i[0]:
                     result.append(t+i)
         return result
 
-    def gen_type_8_serial_single(self, repeat_num=0):
-        return self._gen_serial_moves(self.cards_list, MIN_SINGLE_CARDS, repeat=1, repeat_num=repeat_num)
+    def gen_type_8_serial_single(self, repeat_num=0, rival_rank=None):
+        return self._gen_serial_moves(self.cards_list, MIN_SINGLE_CARDS, repeat=1, repeat_num=repeat_num,
+                                      rival_rank=rival_rank)
 
-    def gen_type_9_serial_pair(self, repeat_num=0):
+    def gen_type_9_serial_pair(self, repeat_num=0, rival_rank=None):
         single_pairs = list()
         for k, v in self.cards_dict.items():
             if v >= 2:
                 single_pairs.append(k)
 
-        return self._gen_serial_moves(single_pairs, MIN_PAIRS, repeat=2, repeat_num=repeat_num)
+        return self._gen_serial_moves(single_pairs, MIN_PAIRS, repeat=2, repeat_num=repeat_num,
+                                      rival_rank=rival_rank)
 
-    def gen_type_10_serial_triple(self, repeat_num=0):
+    def gen_type_10_serial_triple(self, repeat_num=0, rival_rank=None):
         single_triples = list()
         for k, v in self.cards_dict.items():
             if v >= 3:
                 single_triples.append(k)
 
-        return self._gen_serial_moves(single_triples, MIN_TRIPLES, repeat=3, repeat_num=repeat_num)
+        return self._gen_serial_moves(single_triples, MIN_TRIPLES, repeat=3, repeat_num=repeat_num,
+                                      rival_rank=rival_rank)
 
-    def gen_type_11_serial_3_1(self, repeat_num=0):
+    def gen_type_11_serial_3_1(self, repeat_num=0, rival_rank=None):
         serial_3_moves = self.gen_type_10_serial_triple(repeat_num=repeat_num)
         serial_3_1_moves = list()
 
+        if rival_rank is not None:
+            # The rank is the highest rank with three cards, which
+            # can also be in the kickers if there are at least three.
+            # Otherwise, the chains below the rival can be skipped.
+            # They are always at the beginning, so skipping them does
+            # not change how the duplicates are removed below.
+            triple_kickers = [k for k, v in self.cards_dict.items() if v >= 3 and k > rival_rank]
+            if not triple_kickers or (serial_3_moves and len(serial_3_moves[0]) < 9):
+                serial_3_moves = [s3 for s3 in serial_3_moves if s3[-1] > rival_rank]
+
         for s3 in serial_3_moves:  # s3 is like [3,3,3,4,4,4]
             s3_set = set(s3)
             new_cards = [i for i in self.cards_list if i not in s3_set]
@@ -153,10 +182,15 @@ class MovesGener(object):
             for i in subcards:
                 serial_3_1_moves.append(s3 + i)
 
-        return list(k for k, _ in itertools.groupby(serial_3_1_moves))
+        serial_3_1_moves = list(k for k, _ in itertools.groupby(serial_3_1_moves))
+        if rival_rank is not None and serial_3_moves and serial_3_moves[0][-1] <= rival_rank:
+            serial_3_1_moves = [move for move in serial_3_1_moves if get_triple_rank(move) > rival_rank]
+        return serial_3_1_moves
 
-    def gen_type_12_serial_3_2(self, repeat_num=0):
+    def gen_type_12_serial_3_2(self, repeat_num=0, rival_rank=None):
         serial_3_moves = self.gen_type_10_serial_triple(repeat_num=repeat_num)
+        if rival_rank is not None:  # the kickers are pairs, so the rank is the top of the chain
+            serial_3_moves = [s3 for s3 in serial_3_moves if s3[-1] > rival_rank]
         serial_3_2_moves = list()
         pair_set = sorted([k for k, v in self.cards_dict.items() if v >= 2])
 
@@ -171,10 +205,10 @@ class MovesGener(object):
 
         return serial_3_2_moves
 
-    def gen_type_13_4_2(self):
+    def gen_type_13_4_2(self, rival_rank=None):
         four_cards = list()
         for k, v in self.cards_dict.items():
-            if v == 4:
+            if v == 4 and (rival_rank is None or k > rival_rank):
                 four_cards.append(k)
 
         result = list()
@@ -185,10 +219,10 @@ class MovesGener(object):
                 result.append([fc]*4 + i)
         return list(k for k, _ in itertools.groupby(result))
 
-    def gen_type_14_4_22(self):
+    def gen_type_14_4_22(self, rival_rank=None):
         four_cards = list()
         for k, v in self.cards_dict.items():
-            if v == 4:
+            if v == 4 and (rival_rank is None or k > rival_rank):
                 four_cards.append(k)
 
         result = list()
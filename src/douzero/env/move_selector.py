@@ -1,6 +1,19 @@
 # return all moves that can beat rivals, moves and rival_move should be same type
 import collections
 
+# return the highest rank with three cards, i.e., the rank of serial 3+1 and 3+2
+def get_triple_rank(move):
+    counter = collections.Counter(move)
+    return max([k for k, v in counter.items() if v == 3])
+
+# return the rank with four cards, i.e., the rank of 4+2+2
+def get_four_rank(move):
+    rank = 0
+    for k, v in collections.Counter(move).items():
+        if v == 4:
+            rank = k
+    return rank
+
 def common_handle(moves, rival_move):
     new_moves = list()
     for move in moves:
@@ -57,23 +70,19 @@ def filter_type_10_serial_triple(moves, rival_move):
     return common_handle(moves, rival_move)
 
 def filter_type_11_serial_3_1(moves, rival_move):
-    rival = collections.Counter(rival_move)
-    rival_rank = max([k for k, v in rival.items() if v == 3])
+    rival_rank = get_triple_rank(rival_move)
     new_moves = list()
     for move in moves:
-        mymove = collections.Counter(move)
-        my_rank = max([k for k, v in mymove.items() if v == 3])
+        my_rank = get_triple_rank(move)
         if my_rank > rival_rank:
             new_moves.append(move)
     return new_moves
 
 def filter_type_12_serial_3_2(moves, rival_move):
-    rival = collections.Counter(rival_move)
-    rival_rank = max([k for k, v in rival.items() if v == 3])
+    rival_rank = get_triple_rank(rival_move)
     new_moves = list()
     for move in moves:
-        mymove = collections.Counter(move)
-        my_rank = max([k for k, v in mymove.items() if v == 3])
+        my_rank = get_triple_rank(move)
         if my_rank > rival_rank:
             new_moves.append(move)
     return new_moves
@@ -90,17 +99,10 @@ def filter_type_13_4_2(moves, rival_move):
     return new_moves
 
 def filter_type_14_4_22(moves, rival_move):
-    rival = collections.Counter(rival_move)
-    rival_rank = my_rank = 0
-    for k, v in rival.items():
-        if v == 4:
-            rival_rank = k
+    rival_rank = get_four_rank(rival_move)
     new_moves = list()
     for move in moves:
-        mymove = collections.Counter(move)
-        for k, v in mymove.items():
-            if v == 4:
-                my_rank = k
+        my_rank = get_four_rank(move)
         if my_rank > rival_rank:
             new_moves.append(move)
     return new_moves
@@ -0,0 +1,152 @@
+"""
+A precomputed table of all the Doudizhu move patterns.
+Here, a hand is represented by the number of cards of each
+rank, packed into a card set (see cardset.py). A move pattern
+can be played from a hand if and only if its counts do not
+exceed the hand counts, i.e., `move & ~hand == 0`, so the legal
+leads of a hand can be obtained with a single vectorized check
+against the table instead of running all the generators in
+`MovesGener`.
+"""
+import itertools
+
+import numpy as np
+
+from douzero.env import cardset as cs
+from douzero.env.utils import MIN_SINGLE_CARDS, MIN_PAIRS, MIN_TRIPLES, RANKS
+
+# The maximum number of cards in a hand
+MAX_HAND_CARDS = 20
+
+# The ranks that can form a chain, i.e., 3 to A
+SERIAL_RANKS = RANKS[:12]
+# The ranks that have four cards in a deck
+NORMAL_RANKS = RANKS[:13]
+
+def _rank_cap(rank):
+    return 1 if rank in (20, 30) else 4
+
+def _kickers(ranks, num):
+    """
+    All the multisets of `num` cards chosen from `ranks`
+    """
+    result = []
+    for kicker in itertools.combinations_with_replacement(ranks, num):
+        if all(kicker.count(rank) <= _rank_cap(rank) for rank in set(kicker)):
+            result.append(list(kicker))
+    return result
+
+def _chains(min_serial, max_serial):
+    result = []
+    for length in range(min_serial, max_serial + 1):
+        for start in range(len(SERIAL_RANKS) - length + 1):
+            result.append(SERIAL_RANKS[start: start + length])
+    return result
+
+def _gen_all_moves():
+    """
+    Enumerate every move that `MovesGener.gen_moves` can generate
+    from a hand with at most 20 cards, following the same rules
+    for the kickers. The moves are grouped by type in the same
+    order as `gen_moves`.
+    """
+    moves = []
+    moves.extend([[rank] for rank in RANKS])
+    moves.extend([[rank] * 2 for rank in NORMAL_RANKS])
+    moves.extend([[rank] * 3 for rank in NORMAL_RANKS])
+    moves.extend([[rank] * 4 for rank in NORMAL_RANKS])
+    moves.append([20, 30])
+
+    for triple in NORMAL_RANKS:
+        for single in RANKS:
+            if single != triple:
+                moves.append(sorted([triple] * 3 + [single]))
+
+    for triple in NORMAL_RANKS:
+        for pair in NORMAL_RANKS:
+            if pair != triple:
+                moves.append(sorted([triple] * 3 + [pair] * 2))
+
+    for chain in _chains(MIN_SINGLE_CARDS, len(SERIAL_RANKS)):
+        moves.append(chain)
+    for chain in _chains(MIN_PAIRS, MAX_HAND_CARDS // 2):
+        moves.append(sorted(chain * 2))
+    for chain in _chains(MIN_TRIPLES, MAX_HAND_CARDS // 3):
+        moves.append(sorted(chain * 3))
+
+    for chain in _chains(MIN_TRIPLES, MAX_HAND_CARDS // 4):
+        ranks = [rank for rank in RANKS if rank not in chain]
+        for kicker in _kickers(ranks, len(chain)):
+            moves.append(sorted(chain * 3 + kicker))
+
+    for chain in _chains(MIN_TRIPLES, MAX_HAND_CARDS // 5):
+        ranks = [rank for rank in NORMAL_RANKS if rank not in chain]
+        for pairs in itertools.combinations(ranks, len(chain)):
+            moves.append(sorted(chain * 3 + list(pairs) * 2))
+
+    for four in NORMAL_RANKS:
+        ranks = [rank for rank in RANKS if rank != four]
+        for kicker in _kickers(ranks, 2):
+            moves.append(sorted([four] * 4 + kicker))
+
+    for four in NORMAL_RANKS:
+        ranks = [rank for rank in NORMAL_RANKS if rank != four]
+        for pairs in itertools.combinations(ranks, 2):
+            moves.append(sorted([four] * 4 + list(pairs) * 2))
+
+    # Some moves can be generated by more than one type,
+    # e.g., a serial triple of length 4 is also a serial 3+1
+    return list(dict.fromkeys(tuple(move) for move in moves))
+
+class MoveTable(object):
+    """
+    All the move patterns together with their card sets
+    """
+    def __init__(self):
+        # Sorted by the number of cards, so that only a prefix
+        # of the table needs to be checked for small hands
+        self.moves = sorted(_gen_all_moves(), key=len)
+        self.bits = np.array([cs.cards2bits(move) for move in self.moves],
+                             dtype=np.uint64)
+        # The number of moves with at most n cards
+        self.num_moves = np.searchsorted(
+            [len(move) for move in self.moves],
+            np.arange(MAX_HAND_CARDS + 1), side='right')
+
+    def _mask(self, hand_bits):
+        num_moves = self.num_moves[min(cs.count(hand_bits), MAX_HAND_CARDS)]
+        return (self.bits[:num_moves] & np.uint64(~hand_bits & cs.FULL)) == 0
+
+    def gen_moves(self, hand_bits):
+        """
+        Return all the moves that can be played from the hand
+        """
+        mask = self._mask(hand_bits)
+        return [list(self.moves[row]) for row in np.flatnonzero(mask).tolist()]
+
+    def count_moves(self, hand_bits):
+        """
+        Return the number of moves without building them
+        """
+        return int(np.count_nonzero(self._mask(hand_bits)))
+
+_move_table = None
+
+def get_move_table():
+    """
+    The table is built on first use since it takes a while
+    """
+    global _move_table
+    if _move_table is None:
+        _move_table = MoveTable()
+    return _move_table
+
+def gen_moves(hand_bits):
+    """
+    The table based counterpart of `MovesGener(list_cards).gen_moves()`.
+    It returns the same moves, but in a fixed order and without duplicates.
+    """
+    return get_move_table().gen_moves(hand_bits)
+
+def count_moves(hand_bits):
+    return get_move_table().count_moves(hand_bits)
@@ -5,6 +5,9 @@ MIN_SINGLE_CARDS = 5
 MIN_PAIRS = 3
 MIN_TRIPLES = 2
 
+# card ranks in ascending order
+RANKS = [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 17, 20, 30]
+
 # action types
 TYPE_0_PASS = 0
 TYPE_1_SINGLE = 1
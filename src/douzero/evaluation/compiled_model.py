@@ -0,0 +1,135 @@
+"""
+A compiled inference path for the evaluation agents. A trained
+model is exported once as a frozen TorchScript module that only
+computes the values, and loaded with `CompiledModel`, which runs it
+in inference mode with preallocated input buffers.
+
+Export a model:
+    python -m douzero.evaluation.compiled_model export landlord \
+        baselines/douzero_WP/landlord.ckpt landlord.pt
+
+Compare the per-decision latency of the eager and compiled models:
+    python -m douzero.evaluation.compiled_model benchmark landlord \
+        baselines/douzero_WP/landlord.ckpt landlord.pt
+"""
+import argparse
+import zipfile
+
+import numpy as np
+import torch
+from torch import nn
+
+from douzero.env import encoding
+from douzero.env.env import _get_state_features
+
+class ValueModel(nn.Module):
+    """
+    The value head of `LandlordLstmModel`/`FarmerLstmModel` for a
+    single decision in the compact form (see `get_compact_obs` in
+    env.py), without the Python-level branches of `forward`.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.lstm = model.lstm
+        self.dense1 = model.dense1
+        self.dense2 = model.dense2
+        self.dense3 = model.dense3
+        self.dense4 = model.dense4
+        self.dense5 = model.dense5
+        self.dense6 = model.dense6
+
+    def forward(self, z, x_no_action, x_action):
+        num_actions = x_action.shape[0]
+        lstm_out, _ = self.lstm(z.float().unsqueeze(0))
+        x = torch.cat([lstm_out[:, -1, :].expand(num_actions, -1),
+                       x_no_action.float().unsqueeze(0).expand(num_actions, -1),
+                       x_action.float()], dim=-1)
+        x = torch.relu(self.dense1(x))
+        x = torch.relu(self.dense2(x))
+        x = torch.relu(self.dense3(x))
+        x = torch.relu(self.dense4(x))
+        x = torch.relu(self.dense5(x))
+        return self.dense6(x)
+
+def export_model(position, model_path, export_path):
+    """
+    Script and freeze the value model of a checkpoint
+    """
+    from .deep_agent import _load_model
+    model = _load_model(position, model_path)
+    module = torch.jit.freeze(torch.jit.script(ValueModel(model).eval()))
+    torch.jit.save(module, export_path)
+
+def is_compiled_model(model_path):
+    """
+    Whether the file is a TorchScript archive rather than a checkpoint
+    """
+    if not zipfile.is_zipfile(model_path):
+        return False
+    with zipfile.ZipFile(model_path) as f:
+        return any(name.endswith('/constants.pkl') for name in f.namelist())
+
+class CompiledModel(object):
+    """
+    A model exported by `export_model`. The observation is encoded
+    straight into preallocated buffers, and the module runs in
+    inference mode after `torch.jit.optimize_for_inference`, which
+    fuses the Linear/ReLU layers where the backend supports it.
+    """
+    def __init__(self, position, model_path, max_actions=512):
+        self.position = position
+        self.device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        module = torch.jit.load(model_path, map_location=self.device)
+        self.module = torch.jit.optimize_for_inference(module)
+
+        x_dim = 319 if position == 'landlord' else 430
+        self.z = torch.zeros(5, 162, dtype=torch.int8)
+        self.x_no_action = torch.zeros(x_dim, dtype=torch.int8)
+        self.x_action = torch.zeros(max_actions, 54, dtype=torch.int8)
+
+    def predict(self, infoset):
+        """
+        The values of all the legal actions, same as `predict`
+        in deep_agent.py
+        """
+        num_actions = len(infoset.legal_actions)
+        if num_actions > self.x_action.shape[0]:
+            self.x_action = torch.zeros(num_actions, 54, dtype=torch.int8)
+
+        x_no_action, z = _get_state_features(self.position, [infoset])
+        np.copyto(self.x_no_action.numpy(), x_no_action[0])
+        np.copyto(self.z.numpy(), z[0])
+        encoding.cards2arrays(infoset.legal_actions,
+                              out=self.x_action.numpy()[:num_actions])
+
+        with torch.inference_mode():
+            y_pred = self.module(self.z.to(self.device),
+                                 self.x_no_action.to(self.device),
+                                 self.x_action[:num_actions].to(self.device))
+        return y_pred.cpu().numpy()
+
+def benchmark(position, model_path, export_path, num_games=20, seed=0):
+    """
+    The per-decision latency of the eager and compiled models on
+    the same decisions, and the largest difference of the values
+    """
+    from .deep_agent import benchmark
+
+    compiled = CompiledModel(position, export_path)
+    benchmark(position, model_path, 'compiled', compiled.predict, num_games, seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DouZero: compiled models')
+    parser.add_argument('command', choices=['export', 'benchmark'])
+    parser.add_argument('position', choices=['landlord', 'landlord_up', 'landlord_down'])
+    parser.add_argument('model_path', help='The checkpoint of the position')
+    parser.add_argument('export_path', help='The exported TorchScript model')
+    parser.add_argument('--num_games', default=20, type=int,
+                        help='The number of games to benchmark on')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_model(args.position, args.model_path, args.export_path)
+    else:
+        benchmark(args.position, args.model_path, args.export_path,
+                  args.num_games)
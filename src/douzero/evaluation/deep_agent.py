@@ -1,43 +1,237 @@
+import os
+import pickle
+import threading
+import time
+
 import torch
 import numpy as np
 
-from douzero.env.env import get_obs
+from douzero.env import encoding
+from douzero.env.env import get_compact_obs, _action_seq_list2array, _process_action_seq
+
+def load_state_dict(model_path):
+    """
+    The weights of a checkpoint on CPU. The checkpoints in the zip
+    format of `torch.save`, the default since torch 1.6, are
+    memory-mapped, so the processes that load the same checkpoint
+    share the page cache instead of each reading a private copy.
+    The checkpoints in the legacy format are read into memory.
+    """
+    try:
+        return torch.load(model_path, map_location='cpu', mmap=True,
+                          weights_only=True)
+    except (RuntimeError, pickle.UnpicklingError):
+        return torch.load(model_path, map_location='cpu', weights_only=False)
+
+def _load_model(position, model_path, quantize=False):
+    from .compiled_model import CompiledModel, is_compiled_model
+    from .onnx_model import OnnxAgent, is_onnx_model
+    if is_compiled_model(model_path) or is_onnx_model(model_path):
+        if quantize:
+            raise ValueError('Compiled models can not be quantized')
+        if is_onnx_model(model_path):
+            # Exported by onnx_model.py
+            return OnnxAgent(position, model_path)
+        # Exported by compiled_model.py
+        return CompiledModel(position, model_path)
 
-def _load_model(position, model_path):
     from douzero.dmc.models import model_dict
     model = model_dict[position]()
     model_state_dict = model.state_dict()
-    if torch.cuda.is_available():
-        pretrained = torch.load(model_path, map_location='cuda:0')
-    else:
-        pretrained = torch.load(model_path, map_location='cpu')
+    pretrained = load_state_dict(model_path)
     pretrained = {k: v for k, v in pretrained.items() if k in model_state_dict}
     model_state_dict.update(pretrained)
-    model.load_state_dict(model_state_dict)
+    # The parameters take the loaded tensors as they are, so
+    # they stay memory-mapped
+    model.load_state_dict(model_state_dict, assign=True)
+    model.eval()
+    if quantize:
+        # Dynamic int8 on CPU, see `quantize_model`
+        from douzero.dmc.models import quantize_model
+        return quantize_model(model)
     if torch.cuda.is_available():
         model.cuda()
-    model.eval()
     return model
 
+# The models loaded in this process, see `get_model`
+_models = {}
+_models_lock = threading.Lock()
+
+def model_key(position, model_path, quantize=False):
+    """
+    The key of a model in the registry. The checkpoints of the two
+    farmers have the same model class, so a checkpoint played by
+    both of them is loaded once. The compiled models encode the
+    features of their position, so they are keyed by the position.
+    """
+    from .compiled_model import is_compiled_model
+    from .onnx_model import is_onnx_model
+    model_path = os.path.abspath(model_path)
+    if position == 'landlord' or is_compiled_model(model_path) or is_onnx_model(model_path):
+        model_type = position
+    else:
+        model_type = 'farmer'
+    if quantize or not torch.cuda.is_available():
+        device = 'cpu'
+    else:
+        device = 'cuda:0'
+    return (model_type, model_path, device, quantize)
+
+def get_model(position, model_path, quantize=False):
+    """
+    The model of a checkpoint, loaded once per process. The agents
+    only read the weights, so all the agents of a checkpoint share
+    the same model.
+    """
+    key = model_key(position, model_path, quantize)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _load_model(position, model_path, quantize)
+            _models[key] = model
+    return model
+
+def add_models(models):
+    """
+    Add models loaded by another process to the registry,
+    e.g., the shared models of `evaluate` in simulation.py
+    """
+    with _models_lock:
+        _models.update(models)
+
+def _get_device(model):
+    for parameter in model.parameters():
+        return parameter.device
+    # The quantized models have no float parameters
+    return torch.device('cpu')
+
+def predict(model, infoset, history=None):
+    """
+    The values of all the legal actions. The observation is sent
+    to the device in the compact form and expanded by the model.
+    `history` is an optional encoding of the historical moves that
+    is used instead of `z`, see `step_history` in models.py.
+    """
+    if not isinstance(model, torch.nn.Module):
+        # A compiled model, see compiled_model.py and onnx_model.py
+        return model.predict(infoset)
+
+    obs = get_compact_obs(infoset)
+
+    device = _get_device(model)
+    z = torch.from_numpy(obs['z']).to(device)
+    x_no_action = torch.from_numpy(obs['x_no_action']).to(device)
+    x_action = torch.from_numpy(obs['x_action']).to(device)
+    y_pred = model.forward(z, x_no_action, return_value=True,
+                           x_action=x_action, history=history)['values']
+    return y_pred.detach().cpu().numpy()
+
+def benchmark(position, model_path, name, run, num_games=20, seed=0):
+    """
+    The per-decision latency of the eager model of a checkpoint and
+    of `run`, which returns the values of an infoset like `predict`,
+    on the same decisions, and the largest difference of the values.
+    See compiled_model.py and onnx_model.py.
+    """
+    from douzero.env.env import Env
+
+    env = Env('adp')
+    np.random.seed(seed)
+    infosets = []
+    for _ in range(num_games):
+        obs = env.reset()
+        done = False
+        while not done:
+            if env.infoset.player_position == position:
+                infosets.append(env.infoset)
+            legal_actions = obs['legal_actions']
+            action = legal_actions[np.random.randint(len(legal_actions))]
+            obs, _, done, _ = env.step(action)
+
+    eager = _load_model(position, model_path)
+    results = {}
+    for _name, _run in [('eager', lambda infoset: predict(eager, infoset)),
+                        (name, run)]:
+        with torch.no_grad():
+            for infoset in infosets[:10]:
+                _run(infoset)
+            start = time.perf_counter()
+            values = [_run(infoset) for infoset in infosets]
+            results[_name] = (time.perf_counter() - start) / len(infosets), values
+
+    max_diff = max(float(np.abs(a - b).max()) for a, b in
+                   zip(results['eager'][1], results[name][1]))
+    width = max(len('eager'), len(name))
+    print('{} decisions of {}'.format(len(infosets), position))
+    for _name in ['eager', name]:
+        print('{} : {:.3f} ms/decision'.format(_name.ljust(width), results[_name][0] * 1000))
+    print('max value difference: {:.2e}'.format(max_diff))
+
 class DeepAgent:
 
-    def __init__(self, position, model_path):
-        self.model = _load_model(position, model_path)
+    def __init__(self, position, model_path, incremental_history=False,
+                 quantize=False):
+        """
+        If `incremental_history` is set, the LSTM state is carried
+        across the turns of a game, and only the moves since the
+        last turn are fed to the LSTM, three moves per timestep as
+        in `z`. This is an approximation: the models are trained on
+        the last 15 moves encoded from a zero state, while the
+        carried state has seen the whole game. Only the first turn
+        of a game is encoded exactly. It is off by default, and
+        should be evaluated against the windowed encoding before use.
+        If `quantize` is set, the model runs on CPU with dynamic int8
+        Linear and LSTM layers, see `check_quantization` in
+        simulation.py for its accuracy.
+        """
+        self.model = get_model(position, model_path, quantize)
+        if incremental_history and not isinstance(self.model, torch.nn.Module):
+            raise ValueError('incremental_history is not supported by compiled models')
+        self.incremental_history = incremental_history
+        # The moves seen so far in the current game,
+        # their encoding and the LSTM state
+        self._history = None
 
     def act(self, infoset):
-        if len(infoset.legal_actions) == 1:
+        if infoset.legal_actions.is_single():
             return infoset.legal_actions[0]
 
-        obs = get_obs(infoset) 
-
-        z_batch = torch.from_numpy(obs['z_batch']).float()
-        x_batch = torch.from_numpy(obs['x_batch']).float()
-        if torch.cuda.is_available():
-            z_batch, x_batch = z_batch.cuda(), x_batch.cuda()
-        y_pred = self.model.forward(z_batch, x_batch, return_value=True)['values']
-        y_pred = y_pred.detach().cpu().numpy()
+        y_pred = self._predict(infoset)
 
         best_action_index = np.argmax(y_pred, axis=0)[0]
         best_action = infoset.legal_actions[best_action_index]
 
         return best_action
+
+    def _predict(self, infoset):
+        history = None
+        if self.incremental_history:
+            with torch.no_grad():
+                history = self._encode_history(infoset.card_play_action_seq)
+        return predict(self.model, infoset, history)
+
+    def _encode_history(self, card_play_action_seq):
+        from douzero.dmc.models import step_history
+
+        moves, history, state = self._history or ([], None, None)
+        if card_play_action_seq[:len(moves)] != moves:
+            # A new game
+            moves, history, state = [], None, None
+        new_moves = card_play_action_seq[len(moves):]
+
+        z = None
+        if state is None:
+            # Same as the `z` of the observation
+            z = _action_seq_list2array(
+                _process_action_seq(card_play_action_seq))
+        elif len(new_moves) > 0:
+            # Pad with `pass` to whole timesteps like `z`
+            padding = [[] for _ in range(-len(new_moves) % 3)]
+            z = encoding.cards2arrays(padding + new_moves).reshape(-1, 162)
+
+        if z is not None:
+            z = torch.from_numpy(z).to(_get_device(self.model))
+            history, state = step_history(self.model, z, state)
+
+        self._history = (list(card_play_action_seq), history, state)
+        return history
@@ -0,0 +1,124 @@
+"""
+An ONNX inference path for the evaluation agents. A trained model
+is exported once to ONNX, and `OnnxAgent` runs it with the CPU
+provider of onnxruntime. Neither this module nor the features
+import torch, so the evaluation workers and the GUI can play
+without it. Only the export needs torch.
+
+Export a model:
+    python -m douzero.evaluation.onnx_model export landlord \
+        baselines/douzero_WP/landlord.ckpt landlord.onnx
+
+Compare the per-decision latency of the eager and ONNX models:
+    python -m douzero.evaluation.onnx_model benchmark landlord \
+        baselines/douzero_WP/landlord.ckpt landlord.onnx
+"""
+import argparse
+
+import numpy as np
+
+from douzero.env import encoding
+from douzero.env.env import _get_state_features
+
+def export_onnx(position, model_path, export_path):
+    """
+    Export the value model of a checkpoint, see `ValueModel` in
+    compiled_model.py. The number of legal actions is a dynamic
+    axis, so one model serves the decisions of any size.
+    """
+    import torch
+    from .compiled_model import ValueModel
+    from .deep_agent import _load_model
+
+    model = ValueModel(_load_model(position, model_path)).cpu().eval()
+    x_dim = 319 if position == 'landlord' else 430
+    inputs = (torch.zeros(5, 162, dtype=torch.int8),
+              torch.zeros(x_dim, dtype=torch.int8),
+              torch.zeros(2, 54, dtype=torch.int8))
+    torch.onnx.export(model, inputs, export_path,
+                      input_names=['z', 'x_no_action', 'x_action'],
+                      output_names=['values'],
+                      dynamic_axes={'x_action': {0: 'num_actions'},
+                                    'values': {0: 'num_actions'}},
+                      dynamo=False)
+
+def is_onnx_model(model_path):
+    return model_path.endswith('.onnx')
+
+class OnnxAgent(object):
+    """
+    An agent that plays with a model exported by `export_onnx`,
+    same as `DeepAgent`. `intra_op_num_threads` is the number of
+    threads of an operator, and `inter_op_num_threads` of the
+    parallel operators. Both default to one, since the evaluation
+    runs a worker per core. Zero lets onnxruntime decide.
+    """
+    def __init__(self, position, model_path, intra_op_num_threads=1,
+                 inter_op_num_threads=1, max_actions=512):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_num_threads
+        options.inter_op_num_threads = inter_op_num_threads
+        self.session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider'])
+        self.position = position
+
+        x_dim = 319 if position == 'landlord' else 430
+        self.z = np.zeros((5, 162), dtype=np.int8)
+        self.x_no_action = np.zeros(x_dim, dtype=np.int8)
+        self.x_action = np.zeros((max_actions, 54), dtype=np.int8)
+
+    def predict(self, infoset):
+        """
+        The values of all the legal actions, same as `predict`
+        in deep_agent.py
+        """
+        num_actions = len(infoset.legal_actions)
+        if num_actions > self.x_action.shape[0]:
+            self.x_action = np.zeros((num_actions, 54), dtype=np.int8)
+
+        x_no_action, z = _get_state_features(self.position, [infoset])
+        np.copyto(self.x_no_action, x_no_action[0])
+        np.copyto(self.z, z[0])
+        x_action = encoding.cards2arrays(infoset.legal_actions,
+                                         out=self.x_action[:num_actions])
+
+        return self.session.run(None, {'z': self.z,
+                                       'x_no_action': self.x_no_action,
+                                       'x_action': x_action})[0]
+
+    def act(self, infoset):
+        if infoset.legal_actions.is_single():
+            return infoset.legal_actions[0]
+
+        y_pred = self.predict(infoset)
+
+        best_action_index = np.argmax(y_pred, axis=0)[0]
+        return infoset.legal_actions[best_action_index]
+
+def benchmark(position, model_path, export_path, num_games=20, seed=0):
+    """
+    The per-decision latency of the eager and ONNX models on
+    the same decisions, and the largest difference of the values
+    """
+    from .deep_agent import benchmark
+
+    agent = OnnxAgent(position, export_path)
+    benchmark(position, model_path, 'onnx', agent.predict, num_games, seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DouZero: ONNX models')
+    parser.add_argument('command', choices=['export', 'benchmark'])
+    parser.add_argument('position', choices=['landlord', 'landlord_up', 'landlord_down'])
+    parser.add_argument('model_path', help='The checkpoint of the position')
+    parser.add_argument('export_path', help='The exported ONNX model')
+    parser.add_argument('--num_games', default=20, type=int,
+                        help='The number of games to benchmark on')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_onnx(args.position, args.model_path, args.export_path)
+    else:
+        benchmark(args.position, args.model_path, args.export_path,
+                  args.num_games)
@@ -34,7 +34,7 @@ class RLCardAgent(object):
             last_move = ''.join(last_move)
 
             # Last two moves
-            last_two_cards = infoset.last_two_moves
+            last_two_cards = [move.copy() for move in infoset.last_two_moves]
             for i in range(2):
                 for j, c in enumerate(last_two_cards[i]):
                     last_two_cards[i][j] = EnvCard2RealCard[c]
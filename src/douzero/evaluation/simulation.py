@@ -3,7 +3,8 @@ import pickle
 
 from douzero.env.game import GameEnv
 
-def load_card_play_models(card_play_model_path_dict):
+def load_card_play_models(card_play_model_path_dict, incremental_history=False,
+                          quantize=()):
     players = {}
 
     for position in ['landlord', 'landlord_up', 'landlord_down']:
@@ -13,14 +14,46 @@ def load_card_play_models(card_play_model_path_dict):
         elif card_play_model_path_dict[position] == 'random':
             from .random_agent import RandomAgent
             players[position] = RandomAgent()
+        elif card_play_model_path_dict[position].endswith('.onnx'):
+            # Exported by onnx_model.py, runs without torch
+            from .onnx_model import OnnxAgent
+            players[position] = OnnxAgent(position, card_play_model_path_dict[position])
         else:
             from .deep_agent import DeepAgent
-            players[position] = DeepAgent(position, card_play_model_path_dict[position])
+            players[position] = DeepAgent(position, card_play_model_path_dict[position],
+                                          incremental_history=incremental_history,
+                                          quantize=position in quantize)
     return players
 
-def mp_simulate(card_play_data_list, card_play_model_path_dict, q):
-
-    players = load_card_play_models(card_play_model_path_dict)
+def load_shared_models(card_play_model_path_dict, quantize=()):
+    """
+    Load the checkpoints in shared memory, so that the workers
+    of `evaluate` use the same weights instead of loading their
+    own copies. The quantized, compiled and ONNX models are still
+    loaded by each worker.
+    """
+    models = {}
+    for position, model_path in card_play_model_path_dict.items():
+        if model_path in ['rlcard', 'random'] or model_path.endswith('.onnx') \
+                or position in quantize:
+            continue
+        from .compiled_model import is_compiled_model
+        from .deep_agent import get_model, model_key
+        if is_compiled_model(model_path):
+            continue
+        model = get_model(position, model_path)
+        model.share_memory()
+        models[model_key(position, model_path)] = model
+    return models
+
+def mp_simulate(card_play_data_list, card_play_model_path_dict, q,
+                incremental_history=False, quantize=(), shared_models=None):
+
+    if shared_models:
+        from .deep_agent import add_models
+        add_models(shared_models)
+    players = load_card_play_models(card_play_model_path_dict,
+                                    incremental_history, quantize)
 
     env = GameEnv(players)
     for idx, card_play_data in enumerate(card_play_data_list):
@@ -42,7 +75,13 @@ def data_allocation_per_worker(card_play_data_list, num_workers):
 
     return card_play_data_list_each_worker
 
-def evaluate(landlord, landlord_up, landlord_down, eval_data, num_workers):
+def evaluate(landlord, landlord_up, landlord_down, eval_data, num_workers,
+             incremental_history=False, quantize=()):
+    """
+    `quantize` is the positions whose models run with dynamic int8
+    quantization, see `quantize_model` in models.py. Return the WP
+    and ADP of the landlord and the farmers.
+    """
 
     with open(eval_data, 'rb') as f:
         card_play_data_list = pickle.load(f)
@@ -61,13 +100,16 @@ def evaluate(landlord, landlord_up, landlord_down, eval_data, num_workers):
     num_landlord_scores = 0
     num_farmer_scores = 0
 
+    shared_models = load_shared_models(card_play_model_path_dict, quantize)
+
     ctx = mp.get_context('spawn')
     q = ctx.SimpleQueue()
     processes = []
     for card_paly_data in card_play_data_list_each_worker:
         p = ctx.Process(
                 target=mp_simulate,
-                args=(card_paly_data, card_play_model_path_dict, q))
+                args=(card_paly_data, card_play_model_path_dict, q,
+                      incremental_history, quantize, shared_models))
         p.start()
         processes.append(p)
 
@@ -86,3 +128,34 @@ def evaluate(landlord, landlord_up, landlord_down, eval_data, num_workers):
     print('landlord : Farmers - {} : {}'.format(num_landlord_wins / num_total_wins, num_farmer_wins / num_total_wins))
     print('ADP results:')
     print('landlord : Farmers - {} : {}'.format(num_landlord_scores / num_total_wins, 2 * num_farmer_scores / num_total_wins)) 
+
+    return {'wp': {'landlord': num_landlord_wins / num_total_wins,
+                   'farmer': num_farmer_wins / num_total_wins},
+            'adp': {'landlord': num_landlord_scores / num_total_wins,
+                    'farmer': 2 * num_farmer_scores / num_total_wins}}
+
+def check_quantization(landlord, landlord_up, landlord_down, eval_data, num_workers,
+                       max_wp_drop=0.01, max_adp_drop=0.05):
+    """
+    The accuracy guard of the int8 models. The quantized landlord
+    plays against the fp32 farmers, and the quantized farmers
+    against the fp32 landlord, on the same deals as the fp32 models.
+    It passes if neither side loses more than `max_wp_drop` of WP
+    or `max_adp_drop` of ADP.
+    """
+    args = (landlord, landlord_up, landlord_down, eval_data, num_workers)
+    print('fp32:')
+    fp32 = evaluate(*args)
+    print('int8 landlord:')
+    int8_landlord = evaluate(*args, quantize=('landlord',))
+    print('int8 farmers:')
+    int8_farmer = evaluate(*args, quantize=('landlord_up', 'landlord_down'))
+
+    drops = {}
+    for side, results in [('landlord', int8_landlord), ('farmer', int8_farmer)]:
+        drops[side] = {metric: fp32[metric][side] - results[metric][side]
+                       for metric in ['wp', 'adp']}
+    passed = all(drop['wp'] <= max_wp_drop and drop['adp'] <= max_adp_drop
+                 for drop in drops.values())
+    print('Quantization drops: {} ({})'.format(drops, 'passed' if passed else 'failed'))
+    return {'fp32': fp32, 'drops': drops, 'passed': passed}
@@ -1,4 +1,10 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The start of the process, for the time to the first input
+start_time = time.perf_counter()
+
 import numpy as np
 
 from colorama import (
@@ -10,8 +16,6 @@ from colorama import (
 
 from douzero.env.game import GameEnv
 from douzero.env.game import InfoSet
-from douzero.env.game import bombs
-from douzero.evaluation.deep_agent import DeepAgent
 from douzero.evaluation import simulation as sim
 
 from logger import logger
@@ -74,40 +78,13 @@ class MyEnv(GameEnv):
             action = self.players[self.acting_player_position].act(
                 self.game_infoset)
 
-        if len(action) > 0:
-            self.last_pid = self.acting_player_position
-
-        if action in bombs:
-            self.bomb_num += 1
-
-        self.last_move_dict[
-            self.acting_player_position] = action.copy()
-
-        self.card_play_action_seq.append(action)
-        self.update_acting_player_hand_cards(action)
-
-        self.played_cards[self.acting_player_position] += action
-
-        if self.acting_player_position == 'landlord' and \
-                len(action) > 0 and \
-                len(self.three_landlord_cards) > 0:
-            for card in action:
-                if len(self.three_landlord_cards) > 0:
-                    if card in self.three_landlord_cards:
-                        self.three_landlord_cards.remove(card)
-                else:
-                    break
-
-        self.game_done()
-        if not self.game_over:
-            self.get_acting_player_position()
-            self.game_infoset = self.get_infoset()
+        self.apply_action(action)
 
         return action
 
 
 def input_action(info_sets):
-    if len(info_sets['landlord'].legal_actions) == 1:
+    if info_sets['landlord'].legal_actions.is_single():
         return info_sets['landlord'].legal_actions[0]
     while True:
         info = f"{Fore.GREEN}{len(info_sets['landlord_up'].player_hand_cards)} " \
@@ -119,10 +96,8 @@ def input_action(info_sets):
             continue
         if not action:
             return action
-        for a in info_sets['landlord'].legal_actions:
-            if tuple(a) == tuple(action):
-                return action
-        continue
+        if action in info_sets['landlord'].legal_actions:
+            return action
 
 
 def play():
@@ -130,11 +105,15 @@ def play():
     data = generate_data()
 
     logger.info("loading models....")
-    players = sim.load_card_play_models(models)
+    # The models are loaded in the background, while
+    # the player makes the first move
+    executor = ThreadPoolExecutor(max_workers=1)
+    players = executor.submit(sim.load_card_play_models, models)
 
-    env = MyEnv(players)
+    env = MyEnv(None)
     env.card_play_init(data)
     idx = 1
+    logger.info("ready after %.2fs", time.perf_counter() - start_time)
 
     colors = [Fore.GREEN, Fore.RED, Fore.MAGENTA]
 
@@ -142,6 +121,9 @@ def play():
         action = None
         if idx % 3 == 1:
             action = input_action(env.info_sets)
+        if action is None and env.players is None:
+            env.players = players.result()
+            executor.shutdown()
 
         action = env.step(action)
         action = render_action(action)
@@ -4,14 +4,15 @@ import glob
 import random
 import time
 
+# The start of the process, for the time to the first frame
+start_time = time.perf_counter()
+
 import cairosvg
 from PySide6 import QtGui, QtCore, QtWidgets
 
 from douzero.env.game import GameEnv
 from douzero.env.game import InfoSet
 from douzero.env.game import bombs
-from douzero.evaluation.deep_agent import DeepAgent
-from douzero.evaluation import simulation as sim
 
 from logger import logger
 import doudizhu
@@ -168,6 +169,23 @@ class CardList(QtWidgets.QWidget):
         return cards
 
 
+class ModelLoader(QtCore.QThread):
+    """
+    Load the models in the background, so that the window shows
+    up without waiting for torch and the checkpoints
+    """
+
+    loaded = QtCore.Signal(object)
+
+    def run(self):
+        start = time.perf_counter()
+        players = {}
+        for name in player_names:
+            players[name] = doudizhu.DouDizhuAgent(name, models[name])
+        logger.info("models loaded in %.2fs", time.perf_counter() - start)
+        self.loaded.emit(players)
+
+
 class MainWindow(QtWidgets.QMainWindow):
 
     def __init__(self) -> None:
@@ -196,9 +214,11 @@ class MainWindow(QtWidgets.QMainWindow):
 
         logger.info("loading models....")
 
-        self.players = {}
-        for name in player_names:
-            self.players[name] = doudizhu.DouDizhuAgent(name, models[name])
+        # None until the models are loaded
+        self.players = None
+        self.loader = ModelLoader(self)
+        self.loader.loaded.connect(self.models_loaded)
+        self.loader.start()
 
         self.timer = QtCore.QTimer(self)
         # 连接 timeout 信号到自定义的槽函数
@@ -210,12 +230,25 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.start_game()
 
-    def start_game(self):
-        logger.debug("start game")
+    def models_loaded(self, players):
+        self.players = players
+        self.env.players = players
+        self.ui.statusbar.showMessage("模型加载完成")
         self.ui.startButton.setEnabled(True)
         self.ui.showButton.setEnabled(True)
         self.ui.hintButton.setEnabled(True)
 
+    def start_game(self):
+        logger.debug("start game")
+        # The cards are dealt while the models are loading,
+        # but nobody can play until they are loaded
+        loading = self.players is None
+        if loading:
+            self.ui.statusbar.showMessage("模型加载中……")
+        self.ui.startButton.setEnabled(not loading)
+        self.ui.showButton.setEnabled(not loading)
+        self.ui.hintButton.setEnabled(not loading)
+
         for i in [1, 2]:
             self.cardlists[i].hidelist(True)
 
@@ -259,6 +292,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def hint(self):
         action, confidence = self.env.hint()
+        action = action.copy()
         logger.debug("hint %s", action)
         actionname = ",".join([Env2Real[var] for var in action])
         if not action:
@@ -274,10 +308,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def check_action(self, action):
         action = sorted(action)
-        for a in self.env.info_sets[player_names[self.activeindex]].legal_actions:
-            if tuple(a) == tuple(action):
-                return True
-        return False
+        return action in \
+            self.env.info_sets[player_names[self.activeindex]].legal_actions
 
     def show_step(self):
         self.hint()
@@ -288,7 +320,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         cards = self.activelist.get_actived_cards()
         logger.debug(cards)
-        action = [Real2Env[Name2Real[name]] for name in cards]
+        action = sorted([Real2Env[Name2Real[name]] for name in cards])
         logger.debug(action)
 
         if not self.check_action(action):
@@ -343,6 +375,9 @@ def main():
 
     window = MainWindow()
     window.show()
+    # Runs once the event loop has painted the window
+    QtCore.QTimer.singleShot(0, lambda: logger.info(
+        "first frame after %.2fs", time.perf_counter() - start_time))
     sys.exit(app.exec())
 
 